@@ -6,15 +6,22 @@ Compile Instructions:
 2. Install pyinstaller
 3. Activate the virtual environment and run the following command:
     pyinstaller --noconfirm --onefile --windowed "path/to/main.py"
+
+Command Line:
+    Without arguments the GUI is started, to create a report without it run for example:
+    python main.py analyze --frame monthly --in history.csv --out report.html
 """
 
 import sys
-from source.gui import GUI
 
 VERSION = "2.5.6b1"
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        from source.cli import main
+        sys.exit(main(sys.argv[1:], VERSION))
+
     OS_TYPE = None
 
     # check operating system
@@ -27,4 +34,5 @@ if __name__ == '__main__':
         input("\nPress ENTER to exit...")
         sys.exit()
 
+    from source.gui import GUI
     GUI(OS_TYPE, VERSION)
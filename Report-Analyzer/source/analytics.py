@@ -0,0 +1,182 @@
+"""
+Equity curve, drawdown and rolling metrics of the trades
+
+The trades are put in time order once and everything else is a cumulative or rolling array operation
+over them: the running peak of the balance, the drawdown from it and how long it lasted, and the
+win rate and average return over the last trades and the last days. The metrics of every interval
+are reduced from these arrays in one pass and reported with a sparkline of the balance.
+"""
+
+import numpy as np
+import pandas as pd
+
+from source.csv_functions import TIME_FRAME_NAMES, IntervalReport, write_html_table
+
+# Trades of the rolling win rate and average return
+ROLLING_TRADES = 20
+
+# Days of the rolling win rate and average return
+ROLLING_DAYS = 30
+
+# Balances drawn at most in the sparkline of an interval
+SPARKLINE_POINTS = 60
+
+# Size of a sparkline in pixels
+SPARKLINE_WIDTH = 120
+SPARKLINE_HEIGHT = 24
+
+
+def equity_curve(trades: pd.DataFrame, rolling_trades: int = ROLLING_TRADES, rolling_days: int = ROLLING_DAYS) -> pd.DataFrame:
+    """Return the balance, drawdown and rolling metrics after every trade in time order
+
+    The index is the position of every trade in trades. The drawdown is taken from the highest
+    balance so far, its duration is the time since that balance was reached.
+    """
+    order = np.argsort(trades['Time'].to_numpy(), kind='stable')
+    times = trades['Time'].to_numpy()[order]
+    balance = trades['Balance After'].to_numpy()[order]
+    wins = (trades['P&L'].to_numpy()[order] > 0).astype(float)
+    returns = trades['%'].to_numpy()[order]
+
+    peak = np.maximum.accumulate(balance)
+    positions = np.arange(len(balance))
+    peak_positions = np.maximum.accumulate(np.where(balance >= peak, positions, 0))
+
+    last_trades = pd.DataFrame({'Win': wins, 'Return': returns}).rolling(rolling_trades, min_periods=1).mean()
+    last_days = pd.DataFrame({'Win': wins, 'Return': returns}, index=times).rolling(f'{rolling_days}D').mean()
+    return pd.DataFrame({
+        'Time': times,
+        'Balance': balance,
+        'Peak': peak,
+        'Drawdown': balance - peak,
+        'Drawdown %': (balance - peak) / peak * 100,
+        'Drawdown Duration': times - times[peak_positions],
+        'Trade Win Rate': last_trades['Win'].to_numpy() * 100,
+        'Trade Average Return': last_trades['Return'].to_numpy(),
+        'Day Win Rate': last_days['Win'].to_numpy() * 100,
+        'Day Average Return': last_days['Return'].to_numpy(),
+    }, index=order)
+
+
+def sparkline(balances: np.ndarray, start_balance: float) -> str:
+    """Return an inline svg line of the balances, green if the last is at least the start balance, red if not"""
+    if len(balances) > SPARKLINE_POINTS:
+        balances = balances[np.linspace(0, len(balances) - 1, SPARKLINE_POINTS).round().astype(int)]
+    values = np.concatenate([[start_balance], balances])
+    low, high = values.min(), values.max()
+    y = np.full(len(values), SPARKLINE_HEIGHT / 2) if high == low else (
+        (high - values) / (high - low) * (SPARKLINE_HEIGHT - 2) + 1
+    )
+    x = np.linspace(0, SPARKLINE_WIDTH, len(values))
+    points = ' '.join(f'{px:.1f},{py:.1f}' for px, py in zip(x, y))
+    color = '#4CAF50' if values[-1] >= start_balance else '#f44336'
+    return (
+        f'<svg width="{SPARKLINE_WIDTH}" height="{SPARKLINE_HEIGHT}" viewBox="0 0 {SPARKLINE_WIDTH} {SPARKLINE_HEIGHT}">'
+        f'<polyline fill="none" stroke="{color}" stroke-width="1.5" points="{points}"/></svg>'
+    )
+
+
+def interval_equity(
+        report: IntervalReport, rolling_trades: int = ROLLING_TRADES, rolling_days: int = ROLLING_DAYS
+    ) -> tuple:
+    """Return the equity curve of the trades of a report and the equity metrics of every interval
+
+    The metrics of an interval are its end balance, deepest drawdown, longest drawdown and the
+    rolling metrics after its last trade, NaN for an interval without trades.
+    """
+    if report.trades is None:
+        raise ValueError("The equity curve needs the trade details")
+    curve = equity_curve(report.trades, rolling_trades, rolling_days)
+
+    # The curve in interval order and in time order within every interval, cut at the same bounds as the trades
+    codes = np.repeat(np.arange(len(report.bounds) - 1), np.diff(report.bounds))[curve.index]
+    by_interval = curve.iloc[np.argsort(codes, kind='stable')]
+    counts = np.diff(report.bounds)
+    has_trades = counts > 0
+    starts = report.bounds[:-1][has_trades]
+    ends = report.bounds[1:][has_trades] - 1
+
+    def reduced(values: np.ndarray, reduce) -> np.ndarray:
+        # Reduced over the trades of every interval, or the value after its last trade without a reduce
+        result = np.full(len(counts), np.nan)
+        result[has_trades] = reduce(values, starts) if reduce else values[ends]
+        return result
+
+    duration = by_interval['Drawdown Duration'].to_numpy() / np.timedelta64(1, 'D')
+    metrics = pd.DataFrame({
+        'End Balance': reduced(by_interval['Balance'].to_numpy(), None),
+        'Max Drawdown': reduced(by_interval['Drawdown'].to_numpy(), np.minimum.reduceat),
+        'Max Drawdown %': reduced(by_interval['Drawdown %'].to_numpy(), np.minimum.reduceat),
+        'Longest Drawdown': reduced(duration, np.maximum.reduceat),
+        'Trade Win Rate': reduced(by_interval['Trade Win Rate'].to_numpy(), None),
+        'Trade Average Return': reduced(by_interval['Trade Average Return'].to_numpy(), None),
+        'Day Win Rate': reduced(by_interval['Day Win Rate'].to_numpy(), None),
+        'Day Average Return': reduced(by_interval['Day Average Return'].to_numpy(), None),
+    }, index=report.totals.index)
+
+    # The balance before the first trade of every interval, in time order, starts its sparkline
+    first_trades = by_interval.index.to_numpy()[starts]
+    start_balances = report.trades['Balance Before'].to_numpy()[first_trades]
+    balances = by_interval['Balance'].to_numpy()
+    lines = [''] * len(counts)
+    for code, start, end, start_balance in zip(np.flatnonzero(has_trades), starts, ends, start_balances):
+        lines[code] = sparkline(balances[start:end + 1], start_balance)
+    metrics['Equity'] = lines
+    return curve, metrics
+
+
+def format_number(value: float, template: str) -> str:
+    """Format a rounded metric with a template, missing values as empty cells"""
+    return '' if np.isnan(value) else template.format(round(float(value), 2))
+
+
+def write_equity_section(
+        f, title: str, report: IntervalReport, rolling_trades: int = ROLLING_TRADES, rolling_days: int = ROLLING_DAYS
+    ) -> None:
+    """Write the overall drawdown and the equity metrics and sparkline of every interval of a report"""
+    curve, metrics = interval_equity(report, rolling_trades, rolling_days)
+    f.write(f'<h1>{title}</h1>\n')
+    if len(curve):
+        deepest = int(np.argmin(curve['Drawdown %'].to_numpy()))
+        longest = curve['Drawdown Duration'].max()
+        write_html_table(f, ['End Balance', 'Max Drawdown', 'Max Drawdown %', 'Deepest At', 'Longest Drawdown'], [[
+            format_number(curve['Balance'].iloc[-1], "${}"),
+            format_number(curve['Drawdown'].min(), "${}"),
+            format_number(curve['Drawdown %'].iloc[deepest], "{}%"),
+            pd.Timestamp(curve['Time'].iloc[deepest]).strftime('%Y-%m-%d %H:%M:%S'),
+            format_number(longest / pd.Timedelta(days=1), "{} days"),
+        ]])
+        f.write('\n')
+
+    columns = {
+        'Interval': None,
+        'End Balance': "${}",
+        'Max Drawdown': "${}",
+        'Max Drawdown %': "{}%",
+        'Longest Drawdown': "{} days",
+        f'Win Rate ({rolling_trades} Trades)': "{}%",
+        f'Average Return ({rolling_trades} Trades)': "{}%",
+        f'Win Rate ({rolling_days} Days)': "{}%",
+        f'Average Return ({rolling_days} Days)': "{}%",
+        'Equity': None,
+    }
+    values = [metrics.index.astype(str)] + [metrics[column].to_numpy() for column in metrics.columns]
+    templates = list(columns.values())
+    rows = (
+        [
+            str(value) if template is None else format_number(value, template)
+            for value, template in zip(row, templates)
+        ]
+        for row in zip(*values)
+    )
+    write_html_table(f, list(columns), rows)
+
+
+def write_equity_sections(
+        f, reports: dict, rolling_trades: int = ROLLING_TRADES, rolling_days: int = ROLLING_DAYS
+    ) -> None:
+    """Write the equity section of every report with trade details, keyed by time frame or section title"""
+    for section, dataframes in reports.items():
+        if isinstance(dataframes, IntervalReport) and dataframes.trades is not None:
+            name = "" if section is None else f"{TIME_FRAME_NAMES.get(section, section)} "
+            write_equity_section(f, f"{name}Equity and Drawdown", dataframes, rolling_trades, rolling_days)
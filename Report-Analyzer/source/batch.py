@@ -0,0 +1,159 @@
+"""
+Batch analysis of many account histories
+
+Every account history is parsed, aggregated and rendered by its own worker of a process pool, so a
+batch scales with the cores of the machine. The workers only send back the totals of their account,
+never the parsed rows or the report, so the pool spends its time on the analysis instead of on
+pickling. Every account gets its own report and the batch a summary with the totals of every account
+over its whole history. A file that can't be analyzed is listed in the summary instead of stopping
+the batch.
+"""
+
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from source.csv_functions import (
+    aggregate_history, export_html, export_html_frames, format_totals, open_account_history, open_report,
+    table_cells, total_metrics, write_html_head, write_html_table
+)
+from source.exports import file_name
+
+
+def find_account_histories(inputs: list) -> list:
+    """Return the csv files of directories, glob patterns and file paths, in the order given without duplicates"""
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '*.csv')))
+        elif glob.has_magic(pattern):
+            matches = sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+        else:
+            matches = [pattern]
+        paths.extend(os.path.normpath(path) for path in matches)
+    return list(dict.fromkeys(paths))
+
+
+def report_paths(paths: list, output_directory: str) -> list:
+    """Return the report file of every account history, named after the file and unique within the batch"""
+    reports = []
+    used = set()
+    for path in paths:
+        name = file_name(os.path.splitext(os.path.basename(path))[0]) or "account"
+        unique_name = name
+        number = 1
+        while unique_name.lower() in used:
+            number += 1
+            unique_name = f"{name}_{number}"
+        used.add(unique_name.lower())
+        reports.append(os.path.join(output_directory, unique_name + '.html'))
+    return reports
+
+
+def analyze_account(
+        path: str, report_path: str, time_frames: tuple, details: bool = True, use_cache: bool = True
+    ) -> dict:
+    """Analyze one account history, write its report and return its totals, or the error it failed with
+
+    Runs in a worker of the batch, any error of the account is returned so the batch goes on. The
+    report is written to a temporary file first, a failed account never leaves a partial report.
+    """
+    start = time.perf_counter()
+    temporary_path = f"{report_path}.{os.getpid()}.tmp"
+    try:
+        account_history = open_account_history(path, use_cache=use_cache)
+        history = account_history.history()
+        reports = account_history.analyze_frames(time_frames, details)
+        if len(reports) == 1:
+            export_html(reports[time_frames[0]], temporary_path)
+        else:
+            export_html_frames(reports, temporary_path)
+        yearly_sums = aggregate_history([history], 4, details=False)[0]
+        os.replace(temporary_path, report_path)
+    except Exception as e:  # A broken file fails its account, not the batch
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return {'path': path, 'report': None, 'error': f"{type(e).__name__}: {e}"}
+
+    return {
+        'path': path,
+        'report': report_path,
+        'error': None,
+        'rows': len(history),
+        'sums': None if yearly_sums is None else yearly_sums.sum(),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def run_batch(
+        inputs: list, output_directory: str, time_frames: tuple = (4,), details: bool = True,
+        workers: int = None, use_cache: bool = True, progress=None
+    ) -> list:
+    """Analyze every account history of the inputs in a process pool and write a report per account
+
+    inputs are directories, glob patterns or csv files. The pool has a worker per core unless workers
+    is given. Returns the result of every account in the order of the inputs, see analyze_account.
+    progress is called as progress("accounts", count) with the accounts done.
+    """
+    if 5 in time_frames:
+        raise ValueError("The custom time frame can't be used in a batch")
+    paths = find_account_histories(inputs)
+    if not paths:
+        raise ValueError("No account history csv files found")
+    os.makedirs(output_directory, exist_ok=True)
+    reports = report_paths(paths, output_directory)
+
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    results = [None] * len(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(analyze_account, path, report, tuple(time_frames), details, use_cache): position
+            for position, (path, report) in enumerate(zip(paths, reports))
+        }
+        for count, future in enumerate(as_completed(futures), 1):
+            position = futures[future]
+            try:
+                results[position] = future.result()
+            except Exception as e:  # The worker itself died, e.g. it ran out of memory
+                results[position] = {'path': paths[position], 'report': None, 'error': f"{type(e).__name__}: {e}"}
+            if progress:
+                progress("accounts", count)
+    return results
+
+
+def summary_tables(results: list) -> tuple:
+    """Return the totals of every analyzed account and of all accounts together, and the failed accounts"""
+    analyzed = [result for result in results if not result['error'] and result['sums'] is not None]
+    sums = pd.DataFrame(
+        [result['sums'] for result in analyzed], index=[result['path'] for result in analyzed]
+    )
+    if len(sums):
+        sums.loc["All Accounts"] = sums.sum()
+        counts = [column for column in sums.columns if column.startswith('Number of')]
+        sums[counts] = sums[counts].astype(int)
+    totals = format_totals(total_metrics(sums)) if len(sums) else pd.DataFrame()
+    totals.insert(0, 'Report', [os.path.basename(result['report']) for result in analyzed] + [""] * (len(sums) > 0))
+    totals.insert(0, 'Account', sums.index)
+    failed = pd.DataFrame(
+        [(result['path'], result['error']) for result in results if result['error']], columns=['Account', 'Error']
+    )
+    return totals, failed
+
+
+def write_summary(results: list, export_location: str) -> None:
+    """Write the summary of a batch, the totals of every account and the accounts that failed, as one html file"""
+    totals, failed = summary_tables(results)
+    with open_report(export_location) as f:
+        write_html_head(f)
+        f.write('<h1>Account Summary</h1>\n')
+        write_html_table(f, totals.columns, zip(*table_cells(totals)))
+        f.write('\n')
+        if len(failed):
+            f.write('<h1>Failed Accounts</h1>\n')
+            write_html_table(f, failed.columns, zip(*table_cells(failed)))
+            f.write('\n')
+        f.write('</body>\n')
+        f.write('</html>\n')
@@ -0,0 +1,256 @@
+"""
+Synthetic account histories and a benchmark of the analysis stages
+
+generate_history writes a TradingView 'Account History' csv file with the columns is_valid_csv
+expects: long and short closes, commission rows, balances with the non-breaking space thousands
+separator and many symbols, newest row first like the real export. run_benchmarks times reading,
+parsing, aggregating and rendering for every time frame and records the peak memory of each stage.
+The streaming read records how far the resident memory grew instead, which also counts memory
+outside the Python allocator like mapped files, check_stream_memory fails when it grows with the
+size of the history.
+"""
+
+from contextlib import closing
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from source.csv_functions import (
+    ACCOUNT_HISTORY_COLUMNS, TIME_FRAME_NAMES, export_html, parse_account_history, read_chunks, summarize_history
+)
+
+# Rows generated and written at a time
+GENERATE_CHUNK_SIZE = 500_000
+
+# Exchanges the synthetic symbols are listed on
+EXCHANGES = ['NASDAQ', 'NYSE', 'AMEX']
+
+# Share of the rows that are commissions
+COMMISSION_SHARE = 0.3
+
+# Rows of every chunk of the streaming read, small so every benchmarked history is read in many chunks
+STREAM_CHUNK_SIZE = 1_000
+
+# Resident memory of the streaming read may grow by this much plus this share of the growth in file size
+STREAM_MEMORY_SLACK = 8 * 1024 ** 2
+STREAM_MEMORY_GROWTH = 0.25
+
+
+def format_balance(balances: np.ndarray) -> list:
+    """Format balances the way TradingView does, with a non-breaking space as thousands separator"""
+    return [f"{balance:,.2f}".replace(',', '\xa0') for balance in balances]
+
+
+def generate_history(
+        path: str, rows: int, symbols: int = 500, seed: int = 0,
+        end_time: str = "2024-12-31 16:00:00", end_balance: float = 100_000.0
+    ) -> None:
+    """Write a synthetic account history csv file of rows rows"""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    names = {
+        f"{EXCHANGES[i % len(EXCHANGES)]}:{''.join(rng.choice(letters, rng.integers(1, 5)))}" for i in range(symbols)
+    }
+    symbol_names = np.array(sorted(names))
+
+    # The export is newest first, so the history is generated backwards from its end
+    time_cursor = np.datetime64(end_time, 's')
+    balance_cursor = end_balance
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        f.write(','.join(ACCOUNT_HISTORY_COLUMNS) + '\n')
+        for start in range(0, rows, GENERATE_CHUNK_SIZE):
+            size = min(GENERATE_CHUNK_SIZE, rows - start)
+
+            times = time_cursor - np.cumsum(rng.integers(1, 3600, size)).astype('timedelta64[s]')
+            is_commission = rng.random(size) < COMMISSION_SHARE
+            prices = np.round(rng.uniform(1, 900, size), 2)
+            quantities = np.where(rng.random(size) < 0.2, np.round(rng.uniform(0.01, 50, size), 2),
+                                  rng.integers(1, 500, size)).astype(float)
+            trade_profit = np.round(prices * quantities * rng.normal(0, 0.02, size), 2)
+            commission = -np.round(np.maximum(prices * quantities * 0.0005, 0.01), 2)
+            profit = np.where(is_commission, commission, trade_profit)
+
+            balance_after = balance_cursor - np.concatenate(([0.0], np.cumsum(profit)[:-1]))
+            balance_before = balance_after - profit
+            time_cursor = times[-1]
+            balance_cursor = balance_before[-1]
+
+            chosen_symbols = pd.Series(symbol_names[rng.integers(0, len(symbol_names), size)])
+            positions = pd.Series(np.where(rng.random(size) < 0.5, 'long', 'short'))
+            price_text = pd.Series(prices).map('{:.2f}'.format)
+            quantity_text = pd.Series(quantities).map('{:g}'.format)
+            order = " at price " + price_text + " for " + quantity_text + " shares"
+            actions = np.where(
+                is_commission,
+                "Commission for: Enter position for symbol " + chosen_symbols + order,
+                "Close " + positions + " position for symbol " + chosen_symbols + order
+                + ". Position AVG Price was " + price_text + "0000, currency: USD, rate: 1.000000, point value: 1.000000",
+            )
+
+            pd.DataFrame({
+                'Time': pd.Series(times).dt.strftime('%Y-%m-%d %H:%M:%S'),
+                'Balance Before': format_balance(balance_before),
+                'Balance After': format_balance(balance_after),
+                'Realized P&L (value)': profit,
+                'Realized P&L (currency)': 'USD',
+                'Action': actions,
+            }).to_csv(f, header=False, index=False)
+
+
+def measure(function, trace_memory: bool) -> tuple:
+    """Run a function and return its result, wall time in seconds and traced peak memory in bytes"""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def resident_memory() -> int:
+    """Return the resident memory of the process in bytes, None where it can't be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):  # Only Linux has /proc/self/statm
+        return None
+
+
+def stream_file(path: str, chunksize: int = STREAM_CHUNK_SIZE) -> tuple:
+    """Read a file in chunks and return the wall time in seconds and how far the resident memory grew in bytes
+
+    The resident memory is sampled after every chunk, its growth is None where it can't be read.
+    """
+    start_memory = peak = resident_memory()
+    start = time.perf_counter()
+    for _ in read_chunks(path, chunksize):
+        if peak is not None:
+            peak = max(peak, resident_memory())
+    seconds = time.perf_counter() - start
+    return seconds, None if peak is None else peak - start_memory
+
+
+def read_file(path: str) -> pd.DataFrame:
+    """Read a whole account history file the way the analysis does and close it"""
+    with closing(read_chunks(path)) as chunks:
+        return next(chunks)
+
+
+def benchmark_file(path: str, time_frames=(1, 2, 3, 4), trace_memory: bool = True) -> list:
+    """Time every stage of the analysis of one account history file
+
+    The custom time frame 5 reports the first half of the history.
+    """
+    with open(path, encoding='utf-8') as f:
+        rows = sum(1 for _ in f) - 1
+    results = []
+
+    def record(stage: str, function, time_frame: int = None):
+        """Time one stage, memory is traced in a separate run so it doesn't slow down the timed run"""
+        result, seconds, _ = measure(function, False)
+        peak = measure(function, True)[2] if trace_memory else None
+        results.append({
+            'rows': rows,
+            'stage': stage,
+            'time_frame': TIME_FRAME_NAMES.get(time_frame),
+            'seconds': round(seconds, 6),
+            'peak_bytes': peak,
+        })
+        return result
+
+    seconds, peak = stream_file(path)
+    results.append({
+        'rows': rows,
+        'stage': 'stream',
+        'time_frame': None,
+        'seconds': round(seconds, 6),
+        'peak_bytes': peak,
+        'file_bytes': os.path.getsize(path),
+    })
+
+    account_df = record('read', lambda: read_file(path))
+    history = record('parse', lambda account_df=account_df: parse_account_history(account_df))
+    del account_df
+
+    custom_range = (None, None)
+    if 5 in time_frames:
+        times = pd.to_datetime(history['Time'], format='ISO8601')
+        middle = times.min() + (times.max() - times.min()) / 2
+        custom_range = (times.min().strftime('%Y-%m-%d'), middle.strftime('%Y-%m-%d'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for time_frame in time_frames:
+            dataframes = record(
+                'aggregate', lambda: summarize_history([history], time_frame, custom_range), time_frame
+            )
+            report_path = os.path.join(directory, 'report.html')
+            record('render', lambda: export_html(dataframes, report_path), time_frame)
+    return results
+
+
+def run_benchmarks(
+        sizes=(1_000, 10_000, 100_000), time_frames=(1, 2, 3, 4), directory: str = None,
+        trace_memory: bool = True, seed: int = 0, version: str = None, progress=None
+    ) -> dict:
+    """Generate an account history of every size, or reuse the one in directory, and benchmark it
+
+    Returns the results ready to be written as json, progress is called as progress("rows", size)
+    after every size.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for rows in sizes:
+            path = os.path.join(directory or temporary_directory, f"account_history_{rows}.csv")
+            if not os.path.exists(path):
+                generate_history(path, rows, seed=seed)
+            results.extend(benchmark_file(path, time_frames, trace_memory))
+            if progress:
+                progress("rows", rows)
+
+    return {
+        'version': version,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+
+def check_stream_memory(results: list) -> None:
+    """Raise a ValueError when the memory of the streaming read grows with the size of the history
+
+    The smallest and largest benchmarked histories are compared, nothing is checked without two
+    sizes or where the resident memory couldn't be read.
+    """
+    streams = sorted(
+        (result for result in results if result['stage'] == 'stream' and result['peak_bytes'] is not None),
+        key=lambda result: result['rows']
+    )
+    if len(streams) < 2:
+        return
+    smallest, largest = streams[0], streams[-1]
+    growth = largest['peak_bytes'] - smallest['peak_bytes']
+    allowed = STREAM_MEMORY_SLACK + STREAM_MEMORY_GROWTH * (largest['file_bytes'] - smallest['file_bytes'])
+    if growth > allowed:
+        raise ValueError(
+            f"Memory of the streaming read grew by {growth / 1024 ** 2:.1f} MB more at {largest['rows']:,} than at "
+            f"{smallest['rows']:,} rows, more than the allowed {allowed / 1024 ** 2:.1f} MB"
+        )
+
+
+def write_results(results: dict, path: str) -> None:
+    """Write benchmark results as json"""
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,201 @@
+"""
+Persistent cache of parsed account histories
+
+Every parsed history is stored as an uncompressed NumPy .npz file of its typed columns, named after
+the sha1 hash of the csv content, next to a .json file with the path, size and mtime it was parsed
+from. Categorical columns are stored as their codes and categories. A file that is
+unchanged since it was cached is found by path, size and mtime without being read, a moved or
+touched copy is found by its content hash. The modification time of an .npz file is the time it
+was last used, the least recently used entries are evicted once the cache is over its size limit.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from source.csv_functions import concat_histories, history_chunksize, parse_chunks
+
+# Version of the stored columns, entries of another version are parsed again
+FORMAT_VERSION = 2
+
+# Total size of the cache before the least recently used entries are evicted
+CACHE_SIZE_LIMIT = 1024 ** 3
+
+# Categorical columns of a parsed history, stored as their codes and categories
+CATEGORICAL_COLUMNS = ['Position', 'Symbol']
+
+
+def cache_dir() -> str:
+    """Return the user cache directory of the report analyzer"""
+    if sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    elif sys.platform.startswith('darwin'):
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'report-analyzer')
+
+
+def content_hash(path: str) -> str:
+    """Return the sha1 hash of the content of a file"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def list_entries(directory: str = None) -> list:
+    """Return the metadata of every cache entry, most recently used first"""
+    directory = directory or cache_dir()
+    if not os.path.isdir(directory):
+        return []
+
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        key = name[:-len('.json')]
+        data_path = os.path.join(directory, key + '.npz')
+        try:
+            with open(os.path.join(directory, name)) as f:
+                entry = json.load(f)
+            stat = os.stat(data_path)
+        except (OSError, ValueError):
+            continue
+        entry.update(key=key, bytes=stat.st_size, last_used=stat.st_mtime)
+        entries.append(entry)
+    return sorted(entries, key=lambda entry: entry['last_used'], reverse=True)
+
+
+def evict(key: str = None, directory: str = None) -> int:
+    """Remove one cache entry, or every entry without a key, and return the number removed"""
+    directory = directory or cache_dir()
+    keys = [key] if key else [entry['key'] for entry in list_entries(directory)]
+    removed = 0
+    for entry_key in keys:
+        for extension in ('.npz', '.json'):
+            try:
+                os.remove(os.path.join(directory, entry_key + extension))
+            except FileNotFoundError:
+                continue
+            removed += extension == '.npz'
+    return removed
+
+
+def enforce_size_limit(max_bytes: int = CACHE_SIZE_LIMIT, directory: str = None) -> int:
+    """Evict the least recently used entries until the cache fits in max_bytes, return the number removed"""
+    entries = list_entries(directory)
+    total = sum(entry['bytes'] for entry in entries)
+    removed = 0
+    while entries and total > max_bytes:
+        entry = entries.pop()
+        removed += evict(entry['key'], directory)
+        total -= entry['bytes']
+    return removed
+
+
+def find_entry(path: str, directory: str = None) -> tuple:
+    """Return the key of the cache entry of a csv file and whether it's cached
+
+    The content of the file is only hashed if an entry of its size exists, otherwise the key is
+    None and the file is hashed once its parsed rows are stored.
+    """
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    entries = [entry for entry in list_entries(directory) if entry.get('version') == FORMAT_VERSION]
+    for entry in entries:
+        if entry['path'] == path and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return entry['key'], True
+    if not any(entry['size'] == stat.st_size for entry in entries):
+        return None, False
+
+    # The file was moved, copied or touched, look it up by its content
+    key = content_hash(path)
+    if any(entry['key'] == key for entry in entries):
+        write_metadata(key, path, directory)
+        return key, True
+    return key, False
+
+
+def write_metadata(key: str, path: str, directory: str = None) -> None:
+    """Write the path, size and mtime a cache entry was made from"""
+    directory = directory or cache_dir()
+    stat = os.stat(path)
+    with open(os.path.join(directory, key + '.json'), 'w') as f:
+        json.dump({
+            'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime, 'version': FORMAT_VERSION
+        }, f)
+
+
+def load_history(key: str, directory: str = None) -> pd.DataFrame:
+    """Load a parsed history from the cache"""
+    data_path = os.path.join(directory or cache_dir(), key + '.npz')
+    with np.load(data_path, allow_pickle=False) as data:
+        columns = {}
+        for name in data.files:
+            if name == 'index' or name.endswith('.categories'):
+                continue
+            if name.endswith('.codes'):
+                column = name[:-len('.codes')]
+                columns[column] = pd.Categorical.from_codes(data[name], data[column + '.categories'])
+            else:
+                columns[name] = data[name]
+        index = data['index']
+    os.utime(data_path)  # Mark the entry as used
+    return pd.DataFrame(columns, index=index)
+
+
+def store_history(
+        path: str, history: pd.DataFrame, directory: str = None, max_bytes: int = CACHE_SIZE_LIMIT, key: str = None
+    ) -> str:
+    """Store a parsed history in the cache and return its key, the content hash of the file if no key is given"""
+    directory = directory or cache_dir()
+    os.makedirs(directory, exist_ok=True)
+    key = key or content_hash(path)
+
+    columns = {'index': history.index.to_numpy(dtype=np.int64)}
+    for column in history.columns:
+        if column in CATEGORICAL_COLUMNS:
+            values = history[column].cat
+            columns[column + '.codes'] = values.codes.to_numpy()
+            columns[column + '.categories'] = values.categories.to_numpy(dtype=str)
+        elif column == 'Time':
+            columns[column] = history[column].to_numpy()
+        else:
+            columns[column] = history[column].to_numpy(dtype=np.float64)
+
+    # Written to a temporary file first so an interrupted write never leaves a broken entry
+    temporary_path = os.path.join(directory, f"{key}.{os.getpid()}.{time.time_ns()}.tmp.npz")
+    np.savez(temporary_path, **columns)
+    os.replace(temporary_path, os.path.join(directory, key + '.npz'))
+    write_metadata(key, path, directory)
+
+    enforce_size_limit(max_bytes, directory)
+    return key
+
+
+def cached_history(path: str, progress=None, directory: str = None) -> pd.DataFrame:
+    """Return the parsed rows of an account history csv file from the cache, parsing and caching them on a miss"""
+    key = None
+    try:
+        key, cached = find_entry(path, directory)
+        if cached:
+            history = load_history(key, directory)
+            if progress:
+                progress("rows", len(history))
+            return history
+    except (OSError, ValueError, KeyError):
+        pass  # A broken entry is parsed again and overwritten
+
+    history = concat_histories(parse_chunks(path, history_chunksize(path), progress))
+    try:
+        store_history(path, history, directory, key=key)
+    except OSError:
+        pass  # The analysis doesn't depend on the cache being writable
+    return history
@@ -0,0 +1,567 @@
+"""
+Command line interface of the report analyzer
+
+Only the standard library is imported here, pandas and the analysis functions are imported by the
+commands that need them so that '--version' or '--help' start instantly and tkinter or PIL are
+never imported.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Time frame names accepted on the command line
+TIME_FRAMES = {
+    "daily": 1,
+    "monthly": 2,
+    "quarterly": 3,
+    "yearly": 4,
+    "custom": 5,
+    "weekly": 6,
+    "n-day": 7,
+    "hour-of-day": 8,
+    "weekday": 9,
+}
+
+# Time frames of '--frame all'
+ALL_TIME_FRAMES = (1, 2, 3, 4)
+
+
+def selected_time_frames(frames: list) -> tuple:
+    """Return the time frames of the --frame options in order, 'all' adds the daily to yearly ones to the others"""
+    return tuple(dict.fromkeys(
+        time_frame for frame in frames for time_frame in (ALL_TIME_FRAMES if frame == "all" else (TIME_FRAMES[frame],))
+    ))
+
+
+def analyze(args: argparse.Namespace) -> int:
+    """Analyze an account history csv file and export the html report, profiling it if asked to"""
+    if args.profile is None:
+        return export_report(args)
+
+    from source.profiling import Profiler
+
+    with Profiler(trace_memory=args.profile_memory) as profiler:
+        exit_code = export_report(args)
+    print(profiler.format_summary(), file=sys.stderr)
+    if args.profile != "-":
+        profiler.write_json(args.profile)
+        print(f"Profile trace written to {args.profile}", file=sys.stderr)
+    return exit_code
+
+
+def export_report(args: argparse.Namespace) -> int:
+    """Analyze an account history csv file and export the html report and the machine readable tables"""
+    from source.csv_functions import analyze_data, analyze_frames, export_html, open_account_history
+
+    frames = args.frame or ["yearly"]
+    time_frames = selected_time_frames(frames)
+    if 5 in time_frames and (len(time_frames) > 1 or not (args.start and args.end)):
+        print("The custom time frame needs --start and --end and can't be combined with other frames", file=sys.stderr)
+        return 2
+    if args.range and args.chunksize:
+        print("Date ranges can't be combined with --chunksize", file=sys.stderr)
+        return 2
+    if args.db and args.chunksize:
+        print("--chunksize only applies to csv files, not to --db", file=sys.stderr)
+        return 2
+    if args.db and (args.fiscal_start != 1 or any(time_frame > 5 for time_frame in time_frames)):
+        print("The trade store only reports the calendar daily, monthly, quarterly, yearly and custom time frames",
+              file=sys.stderr)
+        return 2
+    if args.symbol and not args.db:
+        print("--symbol needs the trade store to analyze with --db", file=sys.stderr)
+        return 2
+    if not args.output and not args.export:
+        print("Give the html report to write with --out or the tables to export with --export", file=sys.stderr)
+        return 2
+    if (args.breakdown or args.equity) and (args.totals_only or args.interactive):
+        print("--breakdown and --equity need the trade details of the static report, not --totals-only or "
+              "--interactive", file=sys.stderr)
+        return 2
+    if args.ledger and (args.db or args.totals_only or args.interactive):
+        print("--ledger needs the entries of the csv file and the trade details of the static report, not --db, "
+              "--totals-only or --interactive", file=sys.stderr)
+        return 2
+    if args.export and not args.export_dir:
+        print("--export needs the directory to write the tables to with --export-dir", file=sys.stderr)
+        return 2
+
+    details = not args.totals_only
+    try:
+        # Streamed files are parsed chunk by chunk, otherwise the parsed rows come from the cache or the trade store
+        account_history = None
+        if not (args.chunksize or args.db):
+            account_history = open_account_history(args.input, use_cache=not args.no_cache)
+
+        if args.db:
+            reports = analyze_store(args, time_frames, details)
+            data_frames = next(iter(reports.values()))
+        elif args.range:
+            # Every range is cut out of the time sorted rows by binary search
+            ranges = account_history.analyze_ranges(
+                [tuple(custom_range) for custom_range in args.range], details=details
+            )
+            reports = {f"{start} to {end}": data_frames for (start, end), data_frames in ranges.items()}
+        elif len(time_frames) == 1:
+            if account_history:
+                data_frames = account_history.analyze(
+                    time_frames[0], (args.start, args.end), details,
+                    period_days=args.days, fiscal_start=args.fiscal_start
+                )
+            else:
+                data_frames = analyze_data(
+                    args.input, time_frames[0], (args.start, args.end), chunksize=args.chunksize, details=details,
+                    period_days=args.days, fiscal_start=args.fiscal_start
+                )
+            reports = {time_frames[0]: data_frames}
+        else:
+            # Parsed once, the longer time frames are rolled up from the daily sums
+            if account_history:
+                reports = account_history.analyze_frames(
+                    time_frames, details, period_days=args.days, fiscal_start=args.fiscal_start
+                )
+            else:
+                reports = analyze_frames(
+                    args.input, time_frames, chunksize=args.chunksize, details=details,
+                    period_days=args.days, fiscal_start=args.fiscal_start
+                )
+
+        if args.ledger:
+            from source.ledger import add_ledger_columns, position_ledger
+            ledger = position_ledger(args.input, args.chunksize)
+            for report in reports.values():
+                if report:
+                    add_ledger_columns(report, ledger)
+
+        if args.output:
+            if args.range or len(reports) > 1:
+                export_sections(reports, args)
+            elif args.interactive:
+                export_sections({None: data_frames}, args)
+            else:
+                export_html(
+                    data_frames, args.output, workers=args.workers, breakdown=bool(args.breakdown),
+                    by_position=args.breakdown == "position", equity=equity_windows(args)
+                )
+        if args.export:
+            from source.exports import export_tables
+            files = export_tables(reports, args.export_dir, args.export, args.partition)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    if args.output and args.range:
+        print(f"Report of {len(reports)} date ranges written to {args.output}")
+    elif args.output:
+        print(f"Report of {sum(len(data_frames) for data_frames in reports.values())} intervals written to {args.output}")
+    if args.export:
+        print(f"{len(files)} {args.export} files written to {args.export_dir}")
+    return 0
+
+
+def equity_windows(args: argparse.Namespace) -> tuple:
+    """Return the rolling windows of the equity section in trades and days, None without --equity"""
+    return (args.rolling_trades, args.rolling_days) if args.equity else None
+
+
+def analyze_store(args: argparse.Namespace, time_frames: tuple, details: bool) -> dict:
+    """Analyze the rows of the trade store for every range or time frame, optionally of some symbols only"""
+    from source.store import TradeStore
+
+    with TradeStore(args.db) as store:
+        if args.range:
+            return {
+                f"{start} to {end}": store.analyze(5, (start, end), details, args.symbol)
+                for start, end in args.range
+            }
+        custom_range = (args.start, args.end)
+        return {
+            time_frame: store.analyze(time_frame, custom_range, details, args.symbol) for time_frame in time_frames
+        }
+
+
+def export_sections(reports: dict, args: argparse.Namespace) -> None:
+    """Export the reports of several sections as one html report, or as a data driven report if asked to"""
+    if args.interactive:
+        from source.data_report import export_data_report
+        export_data_report(reports, args.output)
+    else:
+        from source.csv_functions import export_html_frames
+        export_html_frames(
+            reports, args.output, workers=args.workers, breakdown=bool(args.breakdown),
+            by_position=args.breakdown == "position", equity=equity_windows(args)
+        )
+
+
+def batch(args: argparse.Namespace) -> int:
+    """Analyze many account histories in parallel, write a report per account and a summary of all of them"""
+    from source.batch import run_batch, write_summary
+
+    frames = args.frame or ["yearly"]
+    if "custom" in frames:
+        print("The custom time frame can't be used in a batch", file=sys.stderr)
+        return 2
+    time_frames = selected_time_frames(frames)
+
+    start = time.perf_counter()
+    try:
+        results = run_batch(
+            args.inputs, args.out_dir, time_frames, details=not args.totals_only, workers=args.workers,
+            use_cache=not args.no_cache
+        )
+        summary = os.path.join(args.out_dir, "summary.html")
+        write_summary(results, summary)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    failed = [result for result in results if result["error"]]
+    for result in failed:
+        print(f"Failed {result['path']}: {result['error']}", file=sys.stderr)
+    print(f"{len(results) - len(failed)} of {len(results)} accounts analyzed in {time.perf_counter() - start:.1f} s, "
+          f"summary written to {summary}")
+    return 1 if failed else 0
+
+
+def watch(args: argparse.Namespace) -> int:
+    """Keep the html report of a directory of account history exports up to date until interrupted"""
+    from source.watch import ReportWatcher
+
+    frames = args.frame or ["yearly"]
+    if "custom" in frames:
+        print("The custom time frame can't be watched", file=sys.stderr)
+        return 2
+    time_frames = selected_time_frames(frames)
+
+    def report_changes(changes: dict) -> None:
+        for path, error in changes["errors"].items():
+            print(f"Error: {path}: {error}", file=sys.stderr)
+        intervals = sum(len(changed) for changed in changes["intervals"].values())
+        print(f"{time.strftime('%H:%M:%S')}  {changes['rows']:,} new rows from {len(changes['paths'])} files, "
+              f"{intervals} intervals updated in {args.output}")
+
+    try:
+        watcher = ReportWatcher(args.directory, args.output, time_frames, not args.totals_only, args.pattern)
+        print(f"Watching {args.directory} for '{args.pattern}', press Ctrl+C to stop")
+        watcher.run(args.interval, report_changes)
+    except KeyboardInterrupt:
+        return 0
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+def serve(args: argparse.Namespace) -> int:
+    """Serve the reports of an account history over http, analyzed and rendered on demand"""
+    from source.server import ReportServer
+
+    try:
+        server = ReportServer(
+            args.input, use_cache=not args.no_cache, cache_entries=args.cache_entries,
+            cache_bytes=int(args.cache_mb * 1024 ** 2)
+        )
+        print(f"Serving reports of {args.input} on http://{args.host}:{args.port}/, press Ctrl+C to stop")
+        server.serve(args.host, args.port)
+    except KeyboardInterrupt:
+        return 0
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+def ingest(args: argparse.Namespace) -> int:
+    """Insert the rows of account history csv files that aren't in the trade store yet"""
+    from source.store import TradeStore
+
+    try:
+        with TradeStore(args.db, create=True) as store:
+            for path in args.inputs:
+                inserted = store.ingest(path)
+                print(f"{inserted:,} new rows from {path}")
+            print(f"{store.row_count():,} rows in {args.db}")
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cache(args: argparse.Namespace) -> int:
+    """List, evict or prune the entries of the parsed history cache"""
+    from source import cache as history_cache
+
+    if args.action == "list":
+        entries = history_cache.list_entries()
+        for entry in entries:
+            last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"]))
+            print(f"{entry['key']}  {entry['bytes'] / 1024 ** 2:8.1f} MB  {last_used}  {entry['path']}")
+        total = sum(entry["bytes"] for entry in entries)
+        print(f"{len(entries)} entries, {total / 1024 ** 2:.1f} MB in {history_cache.cache_dir()}")
+    elif args.action == "evict":
+        if not args.keys and not args.all:
+            print("Give the keys of the entries to evict or --all", file=sys.stderr)
+            return 2
+        removed = history_cache.evict() if args.all else sum(history_cache.evict(key) for key in args.keys)
+        print(f"{removed} entries evicted")
+    else:
+        removed = history_cache.enforce_size_limit(int(args.max_size * 1024 ** 2))
+        print(f"{removed} entries evicted")
+    return 0
+
+
+def memory(args: argparse.Namespace) -> int:
+    """Print the memory used by every column of a parsed account history"""
+    from source.csv_functions import open_account_history
+
+    try:
+        report = open_account_history(args.input, use_cache=not args.no_cache).memory_usage()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{'Column':<16} {'Type':<16} {'Typed':>12} {'Boxed':>12} {'Saved':>8}")
+    for column, row in report.iterrows():
+        print(f"{column:<16} {row['dtype']:<16} {row['Bytes'] / 1024 ** 2:9.1f} MB {row['Boxed Bytes'] / 1024 ** 2:9.1f} MB "
+              f"{row['Saved %']:7.1f}%")
+    return 0
+
+
+def generate(args: argparse.Namespace) -> int:
+    """Write a synthetic account history csv file"""
+    from source.benchmark import generate_history
+
+    generate_history(args.output, args.rows, symbols=args.symbols, seed=args.seed)
+    print(f"{args.rows:,} rows written to {args.output}")
+    return 0
+
+
+def benchmark(args: argparse.Namespace) -> int:
+    """Benchmark the analysis stages on synthetic account histories and write the results as json"""
+    from source.benchmark import check_stream_memory, run_benchmarks, write_results
+
+    frames = args.frame or ["daily", "monthly", "quarterly", "yearly"]
+    results = run_benchmarks(
+        args.sizes, [TIME_FRAMES[frame] for frame in frames], directory=args.dir,
+        trace_memory=not args.no_memory, seed=args.seed, version=args.version_label
+    )
+    for result in results["results"]:
+        peak = "" if result["peak_bytes"] is None else f"{result['peak_bytes'] / 1024 ** 2:10.1f} MB"
+        print(f"{result['rows']:>10,}  {result['stage']:<10} {result['time_frame'] or '':<10} "
+              f"{result['seconds']:10.4f} s  {peak}")
+    if args.output:
+        write_results(results, args.output)
+        print(f"Results written to {args.output}")
+
+    try:
+        check_stream_memory(results["results"])
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def startup_time(args: argparse.Namespace) -> int:
+    """Measure the cold start time of the command line by running 'main.py --version' repeatedly"""
+    command = [sys.executable, sys.argv[0], "--version"]
+    durations = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start)
+
+    print(f"Cold start over {args.runs} runs: median {statistics.median(durations) * 1000:.1f} ms, "
+          f"min {min(durations) * 1000:.1f} ms, max {max(durations) * 1000:.1f} ms")
+    return 0
+
+
+def build_parser(version: str) -> argparse.ArgumentParser:
+    """Create the argument parser of the command line"""
+    parser = argparse.ArgumentParser(
+        prog="main.py", description="Create a report from a TradingView 'Account History' csv file"
+    )
+    parser.add_argument("--version", action="version", version=f"Report Analyzer {version}")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    analyze_parser = commands.add_parser("analyze", help="analyze an account history and export an html report")
+    analyze_parser.add_argument(
+        "--frame", action="append", choices=[*TIME_FRAMES, "all"],
+        help="time frame of the report, repeat it for more sections, 'all' adds daily to yearly (default: yearly)"
+    )
+    source_group = analyze_parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument("--in", dest="input", help="account history csv file")
+    source_group.add_argument("--db", help="trade store to analyze instead of a csv file, see 'ingest'")
+    analyze_parser.add_argument(
+        "--symbol", action="append", help="only analyze the trades of this symbol of the trade store, repeat it for more"
+    )
+    analyze_parser.add_argument(
+        "--out", dest="output", help="html report to write, gzip compressed if it ends in .gz"
+    )
+    analyze_parser.add_argument("--start", help="start date of the custom time frame (YYYY-MM-DD)")
+    analyze_parser.add_argument("--end", help="end date of the custom time frame (YYYY-MM-DD)")
+    analyze_parser.add_argument(
+        "--days", type=int, default=7, help="days of every interval of the n-day time frame (default: 7)"
+    )
+    analyze_parser.add_argument(
+        "--fiscal-start", type=int, default=1, choices=range(1, 13), metavar="MONTH",
+        help="month the fiscal year starts in, quarterly and yearly reports are fiscal after January (default: 1)"
+    )
+    analyze_parser.add_argument(
+        "--range", nargs=2, action="append", metavar=("START", "END"),
+        help="date range to report on (YYYY-MM-DD), repeat it for a section per range"
+    )
+    analyze_parser.add_argument(
+        "--chunksize", type=int, default=None, help="stream the csv file in chunks of this many rows"
+    )
+    analyze_parser.add_argument("--totals-only", action="store_true", help="leave the trade details out of the report")
+    analyze_parser.add_argument(
+        "--breakdown", choices=["symbol", "position"],
+        help="add a section with the totals of every symbol within every interval, 'position' splits long and short"
+    )
+    analyze_parser.add_argument(
+        "--equity", action="store_true",
+        help="add a section with the balance, drawdown, rolling win rate and a sparkline of every interval"
+    )
+    analyze_parser.add_argument(
+        "--rolling-trades", type=int, default=20, help="trades of the rolling metrics of --equity (default: 20)"
+    )
+    analyze_parser.add_argument(
+        "--rolling-days", type=int, default=30, help="days of the rolling metrics of --equity (default: 30)"
+    )
+    analyze_parser.add_argument(
+        "--ledger", action="store_true",
+        help="match every close with its entries first in first out and add the opened time and price, holding "
+             "days and P&L per share to the trade details"
+    )
+    analyze_parser.add_argument(
+        "--interactive", action="store_true",
+        help="write a compact report that embeds the data once and pages, sorts and filters it in the browser"
+    )
+    analyze_parser.add_argument(
+        "--workers", type=int, default=None,
+        help="render the intervals of the html report in shards on this many processes, for very large reports"
+    )
+    analyze_parser.add_argument("--no-cache", action="store_true", help="parse the csv file even if it is cached")
+    analyze_parser.add_argument(
+        "--export", choices=["parquet", "csv", "jsonl"],
+        help="also export the numeric totals and the details of every report in this format"
+    )
+    analyze_parser.add_argument("--export-dir", help="directory to export the tables to")
+    analyze_parser.add_argument(
+        "--partition", action="store_true", help="export a totals and a details file per interval"
+    )
+    analyze_parser.add_argument(
+        "--profile", nargs="?", const="-", metavar="TRACE.json",
+        help="print the time and rows of every stage and optionally write them as a json trace"
+    )
+    analyze_parser.add_argument(
+        "--profile-memory", action="store_true",
+        help="also measure the memory change of every stage with tracemalloc, this slows down the profiled run"
+    )
+    analyze_parser.set_defaults(handler=analyze)
+
+    batch_parser = commands.add_parser(
+        "batch", help="analyze many account histories in parallel and write a report per account and a summary"
+    )
+    batch_parser.add_argument(
+        "inputs", nargs="+", metavar="INPUT", help="account history csv files, directories of them or glob patterns"
+    )
+    batch_parser.add_argument("--out-dir", required=True, help="directory to write the reports and summary.html to")
+    batch_parser.add_argument(
+        "--frame", action="append", choices=[*(frame for frame in TIME_FRAMES if frame != "custom"), "all"],
+        help="time frame of the reports, repeat it for more sections, 'all' adds daily to yearly (default: yearly)"
+    )
+    batch_parser.add_argument("--totals-only", action="store_true", help="leave the trade details out of the reports")
+    batch_parser.add_argument(
+        "--workers", type=int, default=None, help="number of worker processes (default: one per core)"
+    )
+    batch_parser.add_argument("--no-cache", action="store_true", help="parse the csv files even if they are cached")
+    batch_parser.set_defaults(handler=batch)
+
+    watch_parser = commands.add_parser(
+        "watch", help="keep a report of a directory of account history exports up to date as new exports land"
+    )
+    watch_parser.add_argument("directory", help="directory the account history csv files are saved to")
+    watch_parser.add_argument(
+        "--out", dest="output", required=True, help="html report to write, gzip compressed if it ends in .gz"
+    )
+    watch_parser.add_argument(
+        "--frame", action="append", choices=[*(frame for frame in TIME_FRAMES if frame != "custom"), "all"],
+        help="time frame of the report, repeat it for more sections, 'all' adds daily to yearly (default: yearly)"
+    )
+    watch_parser.add_argument("--totals-only", action="store_true", help="leave the trade details out of the report")
+    watch_parser.add_argument("--pattern", default="*.csv", help="file name pattern of the exports (default: *.csv)")
+    watch_parser.add_argument(
+        "--interval", type=float, default=5.0, help="seconds between two checks of the directory (default: 5)"
+    )
+    watch_parser.set_defaults(handler=watch)
+
+    serve_parser = commands.add_parser(
+        "serve", help="serve the reports of an account history on a local web server, e.g. /report?frame=monthly"
+    )
+    serve_parser.add_argument("--in", dest="input", required=True, help="account history csv file")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument("--port", type=int, default=8000, help="port to listen on (default: 8000)")
+    serve_parser.add_argument(
+        "--cache-entries", type=int, default=32, help="analyzed reports and rendered pages to keep (default: 32)"
+    )
+    serve_parser.add_argument(
+        "--cache-mb", type=float, default=256, help="size in MB of the rendered pages to keep (default: 256)"
+    )
+    serve_parser.add_argument("--no-cache", action="store_true", help="parse the csv file even if it is cached")
+    serve_parser.set_defaults(handler=serve)
+
+    ingest_parser = commands.add_parser(
+        "ingest", help="add the new rows of account history csv files to a local trade store"
+    )
+    ingest_parser.add_argument("--db", required=True, help="SQLite trade store, created if it doesn't exist")
+    ingest_parser.add_argument("inputs", nargs="+", metavar="FILE", help="account history csv files")
+    ingest_parser.set_defaults(handler=ingest)
+
+    cache_parser = commands.add_parser("cache", help="inspect and evict the cache of parsed account histories")
+    cache_parser.add_argument("action", choices=["list", "evict", "prune"], help="what to do with the cache")
+    cache_parser.add_argument("keys", nargs="*", help="keys of the entries to evict")
+    cache_parser.add_argument("--all", action="store_true", help="evict every entry")
+    cache_parser.add_argument(
+        "--max-size", type=float, default=1024, help="size in MB to prune the cache to (default: 1024)"
+    )
+    cache_parser.set_defaults(handler=cache)
+
+    memory_parser = commands.add_parser(
+        "memory", help="show the memory used by the typed columns of a parsed account history"
+    )
+    memory_parser.add_argument("--in", dest="input", required=True, help="account history csv file")
+    memory_parser.add_argument("--no-cache", action="store_true", help="parse the csv file even if it is cached")
+    memory_parser.set_defaults(handler=memory)
+
+    generate_parser = commands.add_parser("generate", help="write a synthetic account history csv file")
+    generate_parser.add_argument("--rows", type=int, required=True, help="number of rows to generate")
+    generate_parser.add_argument("--out", dest="output", required=True, help="csv file to write")
+    generate_parser.add_argument("--symbols", type=int, default=500, help="number of different symbols")
+    generate_parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    generate_parser.set_defaults(handler=generate)
+
+    benchmark_parser = commands.add_parser("benchmark", help="time the analysis stages on synthetic histories")
+    benchmark_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="rows of every generated history"
+    )
+    benchmark_parser.add_argument("--frame", action="append", choices=TIME_FRAMES, help="time frames to benchmark")
+    benchmark_parser.add_argument("--dir", help="directory to keep and reuse the generated histories in")
+    benchmark_parser.add_argument("--out", dest="output", help="json file to write the results to")
+    benchmark_parser.add_argument("--no-memory", action="store_true", help="don't trace the peak memory")
+    benchmark_parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    benchmark_parser.set_defaults(handler=benchmark, version_label=version)
+
+    startup_parser = commands.add_parser("startup-time", help="measure the cold start time of the command line")
+    startup_parser.add_argument("--runs", type=int, default=10, help="number of runs to measure")
+    startup_parser.set_defaults(handler=startup_time)
+
+    return parser
+
+
+def main(argv: list, version: str) -> int:
+    """Run the command line and return the exit code"""
+    args = build_parser(version).parse_args(argv)
+    return args.handler(args)
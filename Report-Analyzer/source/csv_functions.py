@@ -1,6 +1,15 @@
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from html import escape
+import gzip
+import importlib.util
+import io
 import sys
 import os
+import time
+import tracemalloc
 
 import_error = False
 
@@ -10,7 +19,9 @@ except ImportError:
     import_error = True
     print("Please install re package: pip install re")
 try:
+    import numpy as np
     import pandas as pd
+    from pandas.api.types import union_categoricals
 except ImportError:
     import_error = True
     print("Please install pandas package: pip install pandas")
@@ -20,183 +31,1306 @@ if import_error:
     sys.exit()
 
 
-def analyze_data(account_history_path: str, time_frame: int, custom_range=(None, None)) -> dict:
-    """Analyze the data from the CSV file and return the dataframe with the results"""
-    account_df = pd.read_csv(account_history_path, sep=',')
-
-    # remove whitespace from balance columns while keeping it a float
-    account_df['Balance Before'] = account_df['Balance Before'].apply(lambda x: float(str(x).replace('\xa0', '')))
-    account_df['Balance After'] = account_df['Balance After'].apply(lambda x: float(str(x).replace('\xa0', '')))
-    
-    # regex patterns to extract the data
-    symbol_pattern = r"symbol (\w+:\w+)"
-    closed_price_pattern = r"price (\d+(?:\.\d+)?)"
-    shares_pattern = r"for (\d+(\.\d+)?) shares"
-    position_type_pattern = r"Close (long|short) position"
-
-    dataframes = {}
-    df_dict = {}
-    
-    # TODO Add another option for custom time frame
-    for _, row in account_df.iterrows():
-        date = row['Time'].split(' ')[0]
-        year = date.split('-')[0]
-        month = date.split('-')[1]
-        #  day = date.split('-')[2]
-
-        # separate by time frame
-        time_interval = ""
-        if time_frame == 1:  # daily
-            time_interval = date
-        elif time_frame == 2:  # monthly
-            time_interval = year + '-' + month
-        elif time_frame == 3:  # quarterly # DEBUG Check format of exported csv for single digit months ex: 2021-1 vs 2021-01
-            time_interval = year + '-'
-            if month in ["01", "02", "03"]:
-                time_interval += "Q1"
-            elif month in ["04", "05", "06"]:
-                time_interval += "Q2"
-            elif month in ["07", "08", "09"]:
-                time_interval += "Q3"
-            elif month in ["10", "11", "12"]:
-                time_interval += "Q4"
-            else:
-                raise ValueError("Invalid month")
-        elif time_frame == 4:  # yearly
-            time_interval = year
-        elif time_frame == 5:  # custom
-            start, end = custom_range
-            start = datetime.strptime(start, "%Y-%m-%d").date()
-            end = datetime.strptime(end, "%Y-%m-%d").date()
-            date = datetime.strptime(date, "%Y-%m-%d").date()
-            if start is None or end is None:
-                raise ValueError("Empty custom range")
-            if start > end:
-                raise ValueError("Invalid custom range (start > end)")
-
-            if start <= date <= end:
-                time_interval = date
-            else:
-                continue
+# Every field of a 'Close ... position' action, in the order TradingView writes them
+ACTION_PATTERN = re.compile(
+    r"Close (?P<Position>long|short) position"
+    r".*?symbol (?P<Symbol>\w+:\w+)"
+    r".*?price (?P<Closed_Price>\d+(?:\.\d+)?)"
+    r".*?for (?P<Quantity>\d+(?:\.\d+)?) shares"
+)
+
+
+# How close an average must be to a half cent to be taken over its trades again, see totals_at_ties
+HALF_CENT_TOLERANCE = 1e-6
+
+# Rows read at a time when streaming an account history
+CHUNK_SIZE = 100_000
+
+# Size of an account history above which it is streamed in chunks instead of read by the whole file engine
+STREAM_FILE_BYTES = 256 * 1024 ** 2
+
+# Rows read to validate an account history before it is analyzed
+SAMPLE_ROWS = 100
+
+# Columns of the TradingView 'Account History' export
+ACCOUNT_HISTORY_COLUMNS = [
+    'Time', 'Balance Before', 'Balance After', 'Realized P&L (value)', 'Realized P&L (currency)', 'Action'
+]
+
+# Columns of the account history that are analyzed and the types they are read as
+ACCOUNT_HISTORY_DTYPES = {
+    'Time': str,
+    'Balance Before': 'float64',
+    'Balance After': 'float64',
+    'Realized P&L (value)': 'float64',
+    'Action': str,
+}
+
+# Thousands separator of the balances, a non-breaking space, as UTF-8 bytes
+THOUSANDS_SEPARATOR = b'\xc2\xa0'
+
+# Bytes of a csv file stripped of thousands separators at a time
+STRIP_BLOCK_BYTES = 1024 ** 2
+
+# Whole files are parsed with the multithreaded pyarrow csv engine when it's installed
+PYARROW_CSV = importlib.util.find_spec("pyarrow") is not None
+
+# Names of the time frames of a report
+TIME_FRAME_NAMES = {
+    1: "Daily",
+    2: "Monthly",
+    3: "Quarterly",
+    4: "Yearly",
+    5: "Custom",
+    6: "Weekly",
+    7: "N-Day",
+    8: "Hour of Day",
+    9: "Weekday",
+}
+
+# Days of an interval of the N-day time frame, the intervals are counted from 1970-01-01
+PERIOD_DAYS = 7
+
+# Month the fiscal year starts in, the quarterly and yearly intervals of a later month are fiscal
+FISCAL_START = 1
+
+# Intervals of the time frames that repeat every day or week, reported in this order instead of by time
+CYCLE_INTERVALS = {
+    8: [f"{hour:02d}:00" for hour in range(24)],
+    9: ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
+}
+
+# Columns of the trade details table of every interval
+DETAIL_COLUMNS = [
+    'Time', 'Position', 'Symbol', 'Quantity', 'Closed Price', 'Balance Before', 'Balance After', 'P&L', '%'
+]
+
+# Categories of the Position column of the parsed trades
+POSITIONS = pd.CategoricalDtype(['long', 'short'])
+
+# How the typed detail columns are displayed in the report, the same as the text of the account history
+DETAIL_FORMATTERS = {
+    'Time': lambda time: time.strftime('%Y-%m-%d %H:%M:%S'),
+    'Quantity': lambda quantity: np.format_float_positional(quantity, trim='-'),
+}
+
+# The open time of the position ledger is shown like the close time
+DETAIL_FORMATTERS['Opened'] = DETAIL_FORMATTERS['Time']
+
+# Size of the write buffer of an html report
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Trades formatted at a time when an html report is written
+WRITE_BATCH_ROWS = 50_000
+
+# Shards of intervals every worker renders when an html report is written in parallel
+SHARDS_PER_WORKER = 4
+
+# Style of the tables of the html reports
+REPORT_STYLE = (
+    'h1 {\n'
+    '  margin-bottom: 0px;\n'
+    '}\n'
+    'table {\n'
+    '  border-collapse: collapse;\n'
+    '  width: 100%;\n'
+    '}\n'
+    'th, td {\n'
+    '  text-align: left;\n'
+    '  padding: 8px;\n'
+    '}\n'
+    'tr:nth-child(even) {\n'
+    '  background-color: #f2f2f2;\n'
+    '}\n'
+    'th {\n'
+    '  background-color: #4CAF50;\n'
+    '  color: white;\n'
+    '}\n'
+)
+
+# Start of the html report up to the body
+HTML_HEAD = '<html>\n<head>\n<style>\n' + REPORT_STYLE + '</style>\n</head>\n<body>\n'
+
+# Totals of every symbol in the symbol breakdown of an interval
+BREAKDOWN_COLUMNS = [
+    'Number of Trades', 'Net Profit', 'Gross Profit', 'Gross Loss', 'Batting Average', 'Average Win', 'Average Loss'
+]
+
+# How each numeric total is displayed in the report
+TOTAL_FORMATS = {
+    'Total Return': "{}%",
+    'Average Return': "{}%",
+    'Batting Average': "{}%",
+    'Average Win': "{}%",
+    'Average Loss': "{}%",
+    'Win Loss Ratio': "{}%",
+    'Net Profit': "${}",
+    'Gross Profit': "${}",
+    'Gross Loss': "${}",
+}
+
+
+class ProfiledStage:
+    """
+    Times one stage of the analysis and reports it to the profile callback, see set_profile_callback
+
+    Attributes:
+        stage (str): The name of the stage
+        rows (int): The number of rows the stage processed, can be set inside the with block
+    """
+    def __init__(self, stage: str, rows: int = 0):
+        self.stage = stage
+        self.rows = rows
+        self._start = 0.0
+        self._memory = None
+
+    def __enter__(self) -> 'ProfiledStage':
+        self._memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_) -> None:
+        seconds = time.perf_counter() - self._start
+        memory = None
+        if self._memory is not None and tracemalloc.is_tracing():
+            memory = tracemalloc.get_traced_memory()[0] - self._memory
+        if _profile_callback:
+            _profile_callback(self.stage, seconds, self.rows, memory)
+
+
+class UnprofiledStage:
+    """Stands in for ProfiledStage while profiling is off so an unprofiled stage costs next to nothing"""
+    rows = 0
+
+    def __enter__(self) -> 'UnprofiledStage':
+        return self
+
+    def __exit__(self, *_) -> None:
+        pass
+
+
+# Called as callback(stage, seconds, rows, memory change) after every profiled stage
+_profile_callback = None
+_unprofiled_stage = UnprofiledStage()
+
+
+def set_profile_callback(callback) -> None:
+    """Set the callback every profiled stage is reported to, None turns profiling off
+
+    The memory change of a stage is only measured while tracemalloc is tracing, otherwise it is None.
+    """
+    global _profile_callback
+    _profile_callback = callback
+
+
+def profile_stage(stage: str, rows: int = 0):
+    """Return a context manager that reports the time of the stage in its with block if profiling is on"""
+    if _profile_callback is None:
+        return _unprofiled_stage
+    return ProfiledStage(stage, rows)
+
+
+def clean_balance(column: pd.Series) -> pd.Series:
+    """Remove the non-breaking space thousands separator from a balance column and return it as floats"""
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype(float)
+    return column.astype(str).str.replace('\xa0', '', regex=False).astype(float)
+
+
+def parse_custom_range(custom_range: tuple) -> tuple:
+    """Return the start and end dates of a custom range of 'YYYY-MM-DD' strings"""
+    start, end = custom_range
+    if start is None or end is None:
+        raise ValueError("Empty custom range")
+    start = datetime.strptime(start, "%Y-%m-%d").date()
+    end = datetime.strptime(end, "%Y-%m-%d").date()
+    if start > end:
+        raise ValueError("Invalid custom range (start > end)")
+    return start, end
+
+
+def sort_by_time(history: pd.DataFrame) -> tuple:
+    """Return the rows sorted by time together with the sorted datetime64 times"""
+    times = history['Time'].to_numpy()
+    order = np.argsort(times, kind='stable')
+    return history.iloc[order], times[order]
+
+
+def slice_range(sorted_history: pd.DataFrame, sorted_times: np.ndarray, custom_range: tuple) -> pd.DataFrame:
+    """Cut the rows of a custom range out of the time sorted rows by binary search, in their original order"""
+    start, end = parse_custom_range(custom_range)
+    first = np.searchsorted(sorted_times, np.datetime64(start, 'D'), side='left')
+    last = np.searchsorted(sorted_times, np.datetime64(end, 'D') + np.timedelta64(1, 'D'), side='left')
+    return sorted_history.iloc[first:last].sort_index()
+
+
+def floored_keys(floors: np.ndarray, key) -> np.ndarray:
+    """Return the key of every floored datetime64, key is only called with the unique floors as a DatetimeIndex"""
+    codes, unique_floors = pd.factorize(floors)
+    keys = key(pd.DatetimeIndex(unique_floors.astype('datetime64[s]')))
+    return np.asarray(keys, dtype=object)[codes]
+
+
+def time_intervals(
+        times: pd.Series, time_frame: int, custom_range=(None, None), period_days: int = PERIOD_DAYS,
+        fiscal_start: int = FISCAL_START
+    ) -> pd.Series:
+    """Return the interval key of every datetime64 row time, rows outside a custom range are NaN
+
+    The N-day intervals are period_days long and keyed by their first and last day. With a
+    fiscal_start after January the quarterly and yearly intervals are fiscal quarters and years,
+    named after the calendar year the fiscal year ends in.
+    """
+    if time_frame == 8:  # hour of day, the only time frame that needs more than the day
+        hours = times.dt.hour.to_numpy()
+        return pd.Series(np.asarray(CYCLE_INTERVALS[8], dtype=object)[hours], index=times.index)
+
+    # Keys are worked out once per unique day, or once per unique period the days are floored to,
+    # and then broadcast back to the rows
+    codes, unique_days = pd.factorize(times.to_numpy().astype('datetime64[D]'))
+    if len(unique_days) == 0:
+        return pd.Series(index=times.index, dtype=object)
+    day_numbers = unique_days.astype(np.int64)  # Days since 1970-01-01, a Thursday
+
+    if time_frame == 1:  # daily
+        keys = pd.DatetimeIndex(unique_days).strftime('%Y-%m-%d')
+    elif time_frame == 2:  # monthly
+        keys = floored_keys(unique_days.astype('datetime64[M]'), lambda firsts: firsts.strftime('%Y-%m'))
+    elif time_frame in (3, 4):  # quarterly and yearly, fiscal if the year doesn't start in January
+        if not 1 <= fiscal_start <= 12:
+            raise ValueError("Invalid fiscal year start month")
+        # Shifted so that every fiscal year starts in January of the calendar year it ends in
+        months = unique_days.astype('datetime64[M]') + np.timedelta64((13 - fiscal_start) % 12, 'M')
+        prefix = '' if fiscal_start == 1 else 'FY'
+        if time_frame == 3:
+            quarters = months - months.astype(np.int64) % 3
+            keys = floored_keys(
+                quarters, lambda firsts: prefix + firsts.strftime('%Y') + '-Q' + firsts.quarter.astype(str)
+            )
+        else:
+            keys = floored_keys(months.astype('datetime64[Y]'), lambda firsts: prefix + firsts.strftime('%Y'))
+    elif time_frame == 5:  # custom
+        start, end = parse_custom_range(custom_range)
+        keys = pd.Series(pd.DatetimeIndex(unique_days).date, dtype=object)
+        keys = keys.where((keys >= start) & (keys <= end))
+    elif time_frame == 6:  # weekly, ISO weeks from Monday to Sunday
+        mondays = unique_days - (day_numbers + 3) % 7
+        keys = floored_keys(mondays, lambda firsts: (
+            firsts.isocalendar()['year'].astype(str) + '-W' + firsts.isocalendar()['week'].astype(str).str.zfill(2)
+        ))
+    elif time_frame == 7:  # every period_days days
+        if period_days < 1:
+            raise ValueError("Invalid number of days of the N-day time frame")
+        keys = floored_keys(unique_days - day_numbers % period_days, lambda firsts: (
+            firsts.strftime('%Y-%m-%d') + ' to ' + (firsts + pd.Timedelta(days=period_days - 1)).strftime('%Y-%m-%d')
+        ))
+    elif time_frame == 9:  # weekday
+        keys = np.asarray(CYCLE_INTERVALS[9], dtype=object)[(day_numbers + 3) % 7]
+    else:
+        raise ValueError("Invalid time frame")
+
+    return pd.Series(np.asarray(keys, dtype=object)[codes], index=times.index)
+
+
+def cycle_order(sums: pd.DataFrame, time_frame: int) -> pd.DataFrame:
+    """Put the sums of an hour of day or weekday report in the order of the day or week, other sums are kept"""
+    if time_frame not in CYCLE_INTERVALS:
+        return sums
+    return sums.reindex([interval for interval in CYCLE_INTERVALS[time_frame] if interval in sums.index])
+
+
+def parse_trades(account_df: pd.DataFrame) -> pd.DataFrame:
+    """Extract the trade details from the 'Close position' rows of the account history"""
+    with profile_stage("extract actions", len(account_df)):
+        fields = account_df['Action'].str.extract(ACTION_PATTERN)
+        if fields['Position'].isna().any():
+            raise ValueError(f"Unrecognized action: {account_df['Action'][fields['Position'].isna()].iloc[0]}")
+
+    with profile_stage("clean balances", len(account_df)):
+        balance_before = clean_balance(account_df['Balance Before'])
+        balance_after = clean_balance(account_df['Balance After'])
+    profit = balance_after - balance_before
+
+    return pd.DataFrame({
+        'Position': fields['Position'].astype(POSITIONS),  # long or short position
+        'Symbol': fields['Symbol'].astype('category'),  # symbol of the stock
+        'Quantity': fields['Quantity'].astype(float),  # quantity of shares
+        'Closed Price': fields['Closed_Price'].astype(float).round(2),  # price at which the position was closed
+        'Balance Before': balance_before.round(2),
+        'Balance After': balance_after.round(2),
+        'P&L': profit.round(2),
+        '%': (profit / balance_before * 100).round(2),
+    })
+
+
+def trade_sums(trades: pd.DataFrame, keys) -> pd.DataFrame:
+    """Aggregate the additive sums of the trades of every key, or combination of keys, in a single grouped pass"""
+    profit = trades['P&L']
+    percent = trades['%']
+    is_win = profit > 0
+    is_loss = profit < 0
+    is_long = trades['Position'] == 'long'
+
+    return pd.DataFrame({
+        'Number of Trades': profit.notna(),
+        'Number of Long Trades': is_long,
+        'Number of Short Trades': trades['Position'] == 'short',
+        'Number of Wins': is_win,
+        'Number of Losses': is_loss,
+        'Total Return': percent,
+        'Win Return': percent.where(is_win, 0.0),
+        'Loss Return': percent.where(is_loss, 0.0),
+        'Net Profit': profit,
+        'Gross Profit': profit.where(is_win, 0.0),
+        'Gross Loss': profit.where(is_loss, 0.0),
+    }).groupby(keys, sort=False).sum()
+
+
+def interval_sums(trades: pd.DataFrame, intervals, commissions: pd.Series) -> pd.DataFrame:
+    """Aggregate the additive trade sums of every interval in a single grouped pass"""
+    sums = trade_sums(trades, intervals)
+    sums = sums.reindex(sums.index.union(commissions.index, sort=False), fill_value=0)
+    sums['Commission'] = commissions.reindex(sums.index, fill_value=0.0)
+    return sums
+
+
+def totals_at_ties(totals: pd.DataFrame, trades: pd.DataFrame, bounds: np.ndarray) -> pd.DataFrame:
+    """Take the unrounded totals of the intervals whose rounding is a tie again with Series.sum and Series.mean
+
+    Whether an average of a half cent rounds up or down, and whether a sum of zero is shown as 0.0 or
+    -0.0, depends on the last bit of the total. That bit differs between the grouped sums and the
+    pairwise sums Series.sum and Series.mean take over the trades of the interval, which the totals
+    of the trade details were always taken with.
+    """
+    averages = totals[['Average Return', 'Average Win', 'Average Loss', 'Win Loss Ratio']].to_numpy()
+    cents = np.abs(np.nan_to_num(averages, nan=0.0, posinf=0.0, neginf=0.0) * 100)
+    is_tie = (np.abs(cents % 1 - 0.5) < HALF_CENT_TOLERANCE).any(axis=1)
+    is_tie |= (totals[['Total Return', 'Net Profit']].abs() < 0.005).any(axis=1).to_numpy()
+    is_tie &= bounds[1:] > bounds[:-1]  # Intervals of only commissions have no totals to take again
+    if not is_tie.any():
+        return totals
+    values = totals.to_numpy(dtype=np.float64, copy=True)
+    percent = trades['%'].to_numpy()
+    profit = trades['P&L'].to_numpy()
+    for code in np.flatnonzero(is_tie):
+        returns = percent[bounds[code]:bounds[code + 1]]
+        profits = profit[bounds[code]:bounds[code + 1]]
+        average_win = series_mean(returns[profits > 0])
+        average_loss = series_mean(returns[profits < 0])
+        with np.errstate(divide='ignore', invalid='ignore'):  # An average loss of 0.0% divides like the grouped one
+            ratio = average_win / abs(average_loss)
+        values[code] = [
+            np.nansum(returns), series_mean(returns), average_win, average_loss, ratio, np.nansum(profits)
+        ]
+    return pd.DataFrame(values, index=totals.index, columns=totals.columns)
+
+
+def series_mean(values: np.ndarray) -> float:
+    """Return the mean of an array the way Series.mean takes it, skipping NaN, NaN if there are no values"""
+    count = np.count_nonzero(~np.isnan(values))
+    return np.nansum(values) / count if count else np.nan
+
+
+def total_metrics(sums: pd.DataFrame, trades: pd.DataFrame = None, bounds: np.ndarray = None) -> pd.DataFrame:
+    """Derive the numeric report totals of every interval from its additive sums
+
+    With the trades sorted by interval, the totals whose rounding is a tie are taken over the trades
+    again so they are rounded like the totals of the trade details, see totals_at_ties.
+    """
+    trades_count = sums['Number of Trades']
+    average_win = sums['Win Return'] / sums['Number of Wins']
+    average_loss = sums['Loss Return'] / sums['Number of Losses']
+    totals = pd.DataFrame({
+        'Total Return': sums['Total Return'],
+        'Average Return': sums['Total Return'] / trades_count,
+        'Average Win': average_win,
+        'Average Loss': average_loss,
+        'Win Loss Ratio': average_win / average_loss.abs(),
+        'Net Profit': sums['Net Profit'],
+    })
+    if trades is not None:
+        totals = totals_at_ties(totals, trades, bounds)
+
+    return pd.DataFrame({
+        'Number of Trades': trades_count,
+        'Number of Long Trades': sums['Number of Long Trades'],
+        'Number of Short Trades': sums['Number of Short Trades'],
+        'Total Return': totals['Total Return'].round(2),
+        'Average Return': totals['Average Return'].round(2),
+        'Batting Average': (sums['Number of Wins'] / trades_count * 100).round(2),
+        'Average Win': totals['Average Win'].round(2),
+        'Average Loss': totals['Average Loss'].round(2),
+        'Win Loss Ratio': totals['Win Loss Ratio'].round(2),
+        'Commission': sums['Commission'].round(2),
+        'Net Profit': totals['Net Profit'].round(2),
+        'Gross Profit': sums['Gross Profit'].round(2),
+        'Gross Loss': sums['Gross Loss'].round(2),
+    }, index=sums.index)
+
+
+def format_totals(metrics: pd.DataFrame) -> pd.DataFrame:
+    """Format the numeric report totals as the percentage and dollar strings shown in the report"""
+    totals = metrics.copy()
+    has_trades = metrics['Number of Trades'] > 0
+    for column, template in TOTAL_FORMATS.items():
+        # only display commission for intervals without any trades
+        totals[column] = pd.Series([
+            template.format(value) if trades else 0 for value, trades in zip(metrics[column], has_trades)
+        ], index=metrics.index, dtype=object)
+    totals['Commission'] = pd.Series([
+        f"${round(float(commission), 2)}" for commission in metrics['Commission']
+    ], index=metrics.index, dtype=object)
+    return totals
+
+
+def symbol_breakdown(report: 'IntervalReport', by_position: bool = False) -> pd.DataFrame:
+    """Return the totals of every symbol, or of every symbol and position, within every interval of a report
+
+    The trades are grouped once over the interval and symbol codes. The rows come in the order of the
+    intervals, the symbols of an interval by net profit with the highest first.
+    """
+    if report.trades is None:
+        raise ValueError("The symbol breakdown needs the trade details")
+    trades = report.trades
+    keys = {
+        'Interval': np.repeat(np.arange(len(report.bounds) - 1), np.diff(report.bounds)),
+        'Symbol': trades['Symbol'].cat.codes.to_numpy(),
+    }
+    if by_position:
+        keys['Position'] = trades['Position'].cat.codes.to_numpy()
+    sums = trade_sums(trades, list(keys.values()))
+    metrics = total_metrics(sums.assign(Commission=0.0))[BREAKDOWN_COLUMNS].reset_index(drop=True)
+
+    codes = [sums.index.get_level_values(level).to_numpy() for level in range(len(keys))]
+    order = np.lexsort((-metrics['Net Profit'].to_numpy(), codes[0]))
+    breakdown = pd.DataFrame({
+        'Interval': report.totals.index.to_numpy(dtype=object)[codes[0]],
+        'Symbol': pd.Categorical.from_codes(codes[1], dtype=trades['Symbol'].dtype),
+    })
+    if by_position:
+        breakdown['Position'] = pd.Categorical.from_codes(codes[2], dtype=POSITIONS)
+    return pd.concat([breakdown, metrics], axis=1).iloc[order].reset_index(drop=True)
+
+
+class ThousandsStrippedFile(io.RawIOBase):
+    """
+    A binary csv file read without the thousands separators of its numbers
+
+    The file is read and stripped a block at a time so memory doesn't grow with its size, a
+    separator split between two blocks is finished with the next block. With a start offset only
+    the header line and the rows from the offset on are read.
+
+    Attributes:
+        path (str): The path to the csv file
+        start (int): The offset of the first row read, at the start of a line, 0 to read every row
+    """
+    def __init__(self, path: str, start: int = 0):
+        super().__init__()
+        self.path = path
+        self.start = start
+        self._file = open(path, 'rb')
+        self._block = b''
+        if start:
+            self._block = self._file.readline()
+            self._file.seek(start)
+        self._position = 0
+        self._tail = b''
+        self._end = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._position == len(self._block) and not self._end:
+            block = self._tail + self._file.read(STRIP_BLOCK_BYTES)
+            self._end = len(block) == len(self._tail)
+            self._tail = block[-1:] if not self._end and block.endswith(THOUSANDS_SEPARATOR[:1]) else b''
+            self._block = block[:len(block) - len(self._tail)].replace(THOUSANDS_SEPARATOR, b'')
+            self._position = 0
+        count = min(len(buffer), len(self._block) - self._position)
+        buffer[:count] = self._block[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+def read_account_csv(source: ThousandsStrippedFile, chunksize: int = None):
+    """Read the analyzed columns of an account history with their types, or a reader of chunks with a chunksize
+
+    The balances come out of the parser as floats, parsed exactly like float() would. A whole file
+    is parsed by the pyarrow engine if it's installed.
+    """
+    options = {'sep': ',', 'usecols': list(ACCOUNT_HISTORY_DTYPES), 'dtype': ACCOUNT_HISTORY_DTYPES}
+    if chunksize is None and PYARROW_CSV:
+        return pd.read_csv(source, engine='pyarrow', **options)
+    return pd.read_csv(source, float_precision='round_trip', chunksize=chunksize, **options)
+
+
+def read_chunks(account_history_path: str, chunksize: int = None):
+    """Yield the account history as DataFrames of at most chunksize rows, or as one DataFrame"""
+    with ThousandsStrippedFile(account_history_path) as source:
+        if chunksize is None:
+            with profile_stage("read csv") as stage:
+                account_df = read_account_csv(source)
+                stage.rows = len(account_df)
+            yield account_df
+            return
+
+        with read_account_csv(source, chunksize) as reader:
+            while True:
+                with profile_stage("read csv") as stage:
+                    account_df = next(reader, None)
+                    stage.rows = 0 if account_df is None else len(account_df)
+                if account_df is None:
+                    return
+                yield account_df
+
+
+def add_sums(sums: pd.DataFrame, chunk_sums: pd.DataFrame) -> pd.DataFrame:
+    """Add the interval sums of a chunk to the running sums, keeping intervals in order of first appearance"""
+    if sums is None:
+        return chunk_sums
+    index = sums.index.union(chunk_sums.index, sort=False)
+    return sums.reindex(index, fill_value=0) + chunk_sums.reindex(index, fill_value=0)
+
+
+def parse_account_history(account_df: pd.DataFrame) -> pd.DataFrame:
+    """Parse every row of the account history, commission rows only fill the Commission column"""
+    is_commission = account_df['Action'].str.contains("Commission", regex=False)
+    history = parse_trades(account_df[~is_commission]).reindex(account_df.index)
+    history.insert(0, 'Time', pd.to_datetime(account_df['Time'], format='ISO8601'))
+    history['Commission'] = account_df['Realized P&L (value)'].astype(float).where(is_commission)
+    return history
+
+
+def concat_histories(histories) -> pd.DataFrame:
+    """Concatenate parsed account history chunks, keeping Symbol categorical across chunks with other symbols"""
+    histories = list(histories)
+    if len(histories) > 1:
+        symbols = union_categoricals([history['Symbol'] for history in histories]).categories
+        histories = [history.assign(Symbol=history['Symbol'].cat.set_categories(symbols)) for history in histories]
+    return pd.concat(histories)
+
+
+def memory_usage_report(history: pd.DataFrame) -> pd.DataFrame:
+    """Compare the memory of every column of a parsed history with the same column as boxed Python objects
+
+    The boxed size is what the column took as text and object values, before the trades were stored
+    as categoricals, datetime64 and fixed width floats.
+    """
+    report = {}
+    for column in history.columns:
+        values = history[column]
+        if column == 'Time':
+            boxed = values.dt.strftime('%Y-%m-%d %H:%M:%S').astype(object)
         else:
-            raise ValueError("Invalid time frame")
+            boxed = values.astype(object)
+        report[column] = {
+            'dtype': str(values.dtype),
+            'Bytes': values.memory_usage(index=False, deep=True),
+            'Boxed Bytes': boxed.memory_usage(index=False, deep=True),
+        }
+    report = pd.DataFrame.from_dict(report, orient='index')
+    report.loc['Total'] = ['', report['Bytes'].sum(), report['Boxed Bytes'].sum()]
+    report['Saved %'] = (100 - report['Bytes'] / report['Boxed Bytes'] * 100).round(1)
+    return report
+
+
+def history_chunksize(account_history_path: str):
+    """Return the chunksize to parse an account history in, None for a file small enough to read at once"""
+    return CHUNK_SIZE if os.path.getsize(account_history_path) > STREAM_FILE_BYTES else None
+
+
+def parse_chunks(account_history_path: str, chunksize: int = None, progress=None):
+    """Yield the parsed rows of the account history chunk by chunk, reporting the rows parsed so far"""
+    rows = 0
+    for account_df in read_chunks(account_history_path, chunksize):
+        yield parse_account_history(account_df)
+        rows += len(account_df)
+        if progress:
+            progress("rows", rows)
+
 
-        if time_interval not in df_dict:
-            df_dict[time_interval] = {"details": [], "commission": 0.0}
+def aggregate_history(
+        histories, time_frame: int, custom_range=(None, None), details: bool = True,
+        period_days: int = PERIOD_DAYS, fiscal_start: int = FISCAL_START
+    ) -> tuple:
+    """Aggregate parsed account history chunks into interval sums
 
-        if "Commission" in row['Action']:  # Add commission to the total and skip rest of processing
-            df_dict[time_interval]["commission"] += float(row['Realized P&L (value)'])
+    Returns the sums of every interval in order of first appearance and, if details are wanted, the
+    trade rows with the interval of every trade, otherwise None for both.
+    """
+    sums = None
+    trade_chunks = []
+    interval_chunks = []
+    for history in histories:
+        # separate by time frame, rows outside of a custom range are dropped
+        with profile_stage("bucket intervals", len(history)):
+            intervals = time_intervals(history['Time'], time_frame, custom_range, period_days, fiscal_start)
+            history = history[intervals.notna()]
+            intervals = intervals[intervals.notna()]
+
+        # Commission rows only add to the interval total, every other row is a closed trade
+        with profile_stage("aggregate", len(history)):
+            is_commission = history['Commission'].notna().to_numpy()
+            commissions = history['Commission'][is_commission].groupby(intervals[is_commission], sort=False).sum()
+            trades = history.loc[~is_commission, DETAIL_COLUMNS]
+            trade_intervals = intervals[~is_commission].to_numpy()
+
+            chunk_sums = interval_sums(trades, trade_intervals, commissions)
+            sums = add_sums(sums, chunk_sums.reindex(intervals.unique(), fill_value=0))
+        if details:
+            trade_chunks.append(trades)
+            interval_chunks.append(trade_intervals)
+
+    if sums is None or not details:
+        return sums, None, None
+    return sums, concat_histories(trade_chunks), np.concatenate(interval_chunks)
+
+
+def build_dataframes(sums: pd.DataFrame, trades: pd.DataFrame = None, trade_codes=None, progress=None) -> 'IntervalReport':
+    """Build the details and total of every interval from its sums and the trades numbered by interval position
+
+    progress is called as progress("intervals", count) once the intervals are built.
+    """
+    details = trades is not None
+    if details:
+        # Sort the trades by interval so the details of every interval are one contiguous slice
+        with profile_stage("sort details", len(trades)):
+            source = trades
+            trade_order = np.argsort(trade_codes, kind='stable')
+            trade_codes = trade_codes[trade_order]
+            trades = trades.iloc[trade_order]
+            bounds = np.searchsorted(trade_codes, np.arange(len(sums) + 1))
+            trades.index = np.arange(len(trades)) - bounds[trade_codes]
+
+    with profile_stage("format totals", len(sums)):
+        metrics = total_metrics(sums, trades, bounds) if details else total_metrics(sums)
+        totals = format_totals(metrics)
+
+    if details:
+        dataframes = IntervalReport(totals, metrics, trades, bounds, source, trade_order)
+    else:
+        dataframes = IntervalReport(totals, metrics)
+    if progress:
+        progress("intervals", len(sums))
+
+    return dataframes
+
+
+class IntervalReport(Mapping):
+    """
+    The details and total of every interval keyed by interval, together with the tables they are cut from
+
+    The html export renders the intervals straight from the arrays of these tables instead of from
+    the DataFrame of every interval. The DataFrames of an interval are cut from the tables every
+    time the interval is looked up, so only the tables are kept, copied and pickled.
+
+    Attributes:
+        totals (pd.DataFrame): The formatted totals, one row per interval in the order of the intervals
+        metrics (pd.DataFrame): The numeric totals the formatted totals are made from
+        trades (pd.DataFrame): The trades sorted by interval, None for a totals only report
+        bounds (np.ndarray): Where the trades of every interval start in trades, followed by the end of the last
+        source (pd.DataFrame): The trades in the order they were analyzed, shared by reports of the same trades
+        order (np.ndarray): The position in source of every row of trades
+
+    Methods:
+        interval_tables(time_interval) -> dict: Cut the total and details of an interval from the tables
+        copy() -> IntervalReport: Return a report of the same tables
+    """
+    def __init__(
+            self, totals: pd.DataFrame, metrics: pd.DataFrame, trades: pd.DataFrame = None,
+            bounds: np.ndarray = None, source: pd.DataFrame = None, order: np.ndarray = None
+        ):
+        self.totals = totals
+        self.metrics = metrics
+        self.trades = trades
+        self.bounds = bounds
+        self.source = source
+        self.order = order
+
+    def __getitem__(self, time_interval) -> dict:
+        if time_interval not in self:
+            raise KeyError(time_interval)
+        return self.interval_tables(time_interval)
+
+    def __contains__(self, time_interval) -> bool:
+        return time_interval in self.totals.index
+
+    def __iter__(self):
+        return iter(self.totals.index)
+
+    def __len__(self) -> int:
+        return len(self.totals)
+
+    def copy(self) -> 'IntervalReport':
+        """Return a report of the same tables"""
+        return IntervalReport(self.totals, self.metrics, self.trades, self.bounds, self.source, self.order)
+
+    def interval_tables(self, time_interval) -> dict:
+        """Cut the total and details of an interval from the tables"""
+        code = self.totals.index.get_loc(time_interval)
+        tables = {
+            "total": pd.DataFrame(
+                self.totals.iloc[code:code + 1].to_numpy(dtype=object), columns=self.totals.columns, dtype=object
+            ),
+        }
+        if self.trades is not None:
+            start, stop = self.bounds[code], self.bounds[code + 1]
+            # Possible to be empty if only a commission was made that day and no trades
+            tables["details"] = self.trades.iloc[start:stop] if start < stop else pd.DataFrame()
+        return tables
+
+
+def summarize_history(
+        histories, time_frame: int, custom_range=(None, None), details: bool = True, progress=None,
+        period_days: int = PERIOD_DAYS, fiscal_start: int = FISCAL_START
+    ) -> dict:
+    """Summarize parsed account history chunks into the details and total of every interval"""
+    sums, trades, trade_intervals = aggregate_history(
+        histories, time_frame, custom_range, details, period_days, fiscal_start
+    )
+    if sums is None:
+        return {}
+    sums = cycle_order(sums, time_frame)
+    if trades is None:
+        return build_dataframes(sums, progress=progress)
+    return build_dataframes(sums, trades, sums.index.get_indexer(trade_intervals), progress)
+
+
+def summarize_frames(
+        histories, time_frames=(1, 2, 3, 4), details: bool = True, progress=None,
+        period_days: int = PERIOD_DAYS, fiscal_start: int = FISCAL_START
+    ) -> dict:
+    """Summarize parsed account history chunks for several time frames at once
+
+    The rows are aggregated by day only once, the sums of the longer time frames are rolled up from
+    the daily sums and the averages and ratios are derived from the rolled up sums. The hour of day
+    time frame can't be rolled up from days, its rows are aggregated again, but its trades are the
+    same table as those of the other time frames. Returns the dataframes of every time frame keyed
+    by time frame.
+    """
+    if 5 in time_frames:
+        raise ValueError("The custom time frame can't be rolled up from daily sums")
+    if 8 in time_frames:
+        histories = list(histories)  # Kept to aggregate them by hour as well
+    daily_sums, trades, trade_days = aggregate_history(histories, 1, details=details)
+    if daily_sums is None:
+        return {time_frame: {} for time_frame in time_frames}
+    if trades is not None:
+        trade_day_codes = daily_sums.index.get_indexer(trade_days)
+
+    reports = {}
+    for time_frame in time_frames:
+        if time_frame == 8:
+            # The commissions are aggregated by hour again, the trades stay the ones of the other time frames
+            sums = cycle_order(aggregate_history(histories, 8, details=False)[0], 8)
+            if trades is None:
+                reports[time_frame] = build_dataframes(sums, progress=progress)
+            else:
+                trade_hours = time_intervals(trades['Time'], 8).to_numpy()
+                reports[time_frame] = build_dataframes(sums, trades, sums.index.get_indexer(trade_hours), progress)
             continue
 
-        # Add the trade details to the dictionary for the time interval
-        df_dict[time_interval]["details"].append({
-            'Time': row['Time'],
-            'Position': re.search(position_type_pattern, row['Action']).group(1),  # long or short position,
-            'Symbol': re.search(symbol_pattern, row['Action']).group(1),  # symbol of the stock,
-            'Quantity': re.search(shares_pattern, row['Action']).group(1),  # quantity of shares,
-            # Removed because it's never right           'Opened Price': round(float(row['Balance Before']) - (float(re.search(closed_price_pattern, row['Action']).group(1)) * int(re.search(shares_pattern, row['Action']).group(1))) / int(re.search(shares_pattern, row['Action']).group(1)), 2),
-            'Closed Price': round(float(re.search(closed_price_pattern, row['Action']).group(1)), 2),  # price at which the position was closed
-            'Balance Before': round(float(row['Balance Before']), 2),
-            'Balance After': round(float(row['Balance After']), 2),
-            'P&L': round(float(row['Balance After']) - float(row['Balance Before']), 2),
-            '%': round((float(row['Balance After']) - float(row['Balance Before'])) / float(row['Balance Before']) * 100, 2),
-        })
-
-    # Create total dataframes and append to dataframes dictionary
-    for time_frame in df_dict:
-        details_df = pd.DataFrame(df_dict[time_frame]["details"])
-        if details_df.empty:  # Possible if only a commission was made that day and no trades
-            # only display commisson
-            total_df = pd.DataFrame({
-                'Number of Trades': [0],
-                'Number of Long Trades': [0],
-                'Number of Short Trades': [0],
-                'Total Return': [0],
-                'Average Return': [0],
-                'Batting Average': [0],
-                'Average Win': [0],
-                'Average Loss': [0],
-                'Win Loss Ratio': [0],
-                'Commission': [f"${round(df_dict[time_frame]['commission'], 2)}"],
-                'Net Profit': [0],
-                'Gross Profit': [0],
-                'Gross Loss': [0],
-            })
-            dataframes[time_frame] = {"details": details_df, "total": total_df}
+        # Days appear in order, so the intervals rolled up from them keep their order of first appearance
+        days = pd.Series(pd.to_datetime(daily_sums.index, format='%Y-%m-%d'))
+        day_intervals = time_intervals(days, time_frame, period_days=period_days, fiscal_start=fiscal_start).to_numpy()
+        sums = cycle_order(daily_sums.groupby(day_intervals, sort=False).sum(), time_frame)
+        if trades is None:
+            reports[time_frame] = build_dataframes(sums, progress=progress)
             continue
+        day_codes = sums.index.get_indexer(day_intervals)
+        reports[time_frame] = build_dataframes(sums, trades, day_codes[trade_day_codes], progress)
 
-        total_commission = round(df_dict[time_frame]["commission"], 2)
-        number_of_trades = [details_df['P&L'].count()]
-        number_of_long_trades = [details_df[details_df['Position'] == 'long']['P&L'].count()]
-        number_of_short_trades = [details_df[details_df['Position'] == 'short']['P&L'].count()]
-        net_profit_amount = [round(details_df['P&L'].sum(), 2)]
-        total_profit_amount = [round(details_df[details_df['P&L'] > 0]['P&L'].sum(), 2)]
-        total_loss_amount = [round(details_df[details_df['P&L'] < 0]['P&L'].sum(), 2)]
-        total_return_percentage = [round(details_df['%'].sum(), 2)]
-        average_return_percentage = [round(details_df['%'].mean(), 2)]
-        batting_average = [round(details_df[details_df['P&L'] > 0]['P&L'].count() / details_df['P&L'].count() * 100, 2)]
-        average_win_percentage = [round(details_df[details_df['P&L'] > 0]['%'].mean(), 2)]
-        average_loss_percentage = [round(details_df[details_df['P&L'] < 0]['%'].mean(), 2)]
-        win_loss_ratio_percentage = [round(details_df[details_df['P&L'] > 0]['%'].mean() / abs(details_df[details_df['P&L'] < 0]['%'].mean()), 2)]
-
-        total_df = pd.DataFrame({
-            'Number of Trades': [number_of_trades[0]],
-            'Number of Long Trades': [number_of_long_trades[0]],
-            'Number of Short Trades': [number_of_short_trades[0]],
-            'Total Return': [f"{total_return_percentage[0]}%"],
-            'Average Return': [f"{average_return_percentage[0]}%"],
-            'Batting Average': [f"{batting_average[0]}%"],
-            'Average Win': [f"{average_win_percentage[0]}%"],
-            'Average Loss': [f"{average_loss_percentage[0]}%"],
-            'Win Loss Ratio': [f"{win_loss_ratio_percentage[0]}%"],
-            'Commission': [f"${total_commission}"],
-            'Net Profit': [f"${net_profit_amount[0]}"],
-            'Gross Profit': [f"${total_profit_amount[0]}"],
-            'Gross Loss': [f"${total_loss_amount[0]}"],
-        })
-
-        dataframes[time_frame] = {"details": details_df, "total": total_df}
+    return reports
+
+
+def analyze_data(
+        account_history_path: str, time_frame: int, custom_range=(None, None),
+        chunksize: int = None, details: bool = True, progress=None,
+        period_days: int = PERIOD_DAYS, fiscal_start: int = FISCAL_START
+    ) -> dict:
+    """Analyze the data from the CSV file and return the dataframe with the results
+
+    With a chunksize the file is streamed, only the running interval sums and, if details are
+    wanted, the parsed trade rows are kept in memory. progress is called as progress(stage, count)
+    with the "rows" parsed and the "intervals" aggregated.
+    """
+    histories = parse_chunks(account_history_path, chunksize, progress)
+    return summarize_history(histories, time_frame, custom_range, details, progress, period_days, fiscal_start)
+
+
+def analyze_frames(
+        account_history_path: str, time_frames=(1, 2, 3, 4), chunksize: int = None,
+        details: bool = True, progress=None, period_days: int = PERIOD_DAYS, fiscal_start: int = FISCAL_START
+    ) -> dict:
+    """Analyze the data from the CSV file for several time frames with a single parse, see summarize_frames"""
+    histories = parse_chunks(account_history_path, chunksize, progress)
+    return summarize_frames(histories, time_frames, details, progress, period_days, fiscal_start)
+
+
+def open_account_history(
+        account_history_path: str, sample_rows: int = SAMPLE_ROWS, use_cache: bool = True
+    ) -> 'AccountHistory':
+    """Validate the header and first rows of an account history csv file and return a handle to it"""
+    try:
+        sample_df = pd.read_csv(account_history_path, sep=',', nrows=sample_rows)
+    except Exception as e:
+        raise ValueError(f"Could not read csv file: {e}") from e
+
+    for column in sample_df.columns:
+        if column not in ACCOUNT_HISTORY_COLUMNS:
+            raise ValueError(f"Unexpected column: {column}")
+    for column in ACCOUNT_HISTORY_COLUMNS:
+        if column not in sample_df.columns and column != 'Realized P&L (currency)':
+            raise ValueError(f"Missing column: {column}")
+
+    # Check the formats of the sample so a wrong file fails now instead of during the export
+    try:
+        time_intervals(parse_account_history(sample_df)['Time'], 1)
+    except Exception as e:
+        raise ValueError(f"Invalid account history row: {e}") from e
+
+    return AccountHistory(account_history_path, use_cache)
+
+
+class AccountHistory:
+    """
+    A validated 'Account History' csv file that is read and parsed at most once
+
+    Attributes:
+        path (str): The path to the csv file
+        size (int): The size of the file when it was opened
+        mtime (float): The modification time of the file when it was opened
+        use_cache (bool): Load the parsed rows from the persistent cache and store them there
+
+    Methods:
+        is_stale() -> bool: Check if the file changed since it was opened
+        history(progress) -> pd.DataFrame: Return the parsed rows of the file, parsing it on first use
+        memory_usage(progress) -> pd.DataFrame: Return the memory usage report of the parsed rows
+        sorted_history(progress) -> tuple: Return the parsed rows sorted by time and their datetime64 times
+        analyze(time_frame: int, custom_range: tuple, details: bool, progress, period_days: int, fiscal_start: int) -> dict: Analyze the parsed rows
+        analyze_frames(time_frames: tuple, details: bool, progress, period_days: int, fiscal_start: int) -> dict: Analyze the parsed rows for several time frames
+        analyze_ranges(custom_ranges: list, details: bool, progress) -> dict: Analyze the parsed rows of several custom ranges
+    """
+    def __init__(self, path: str, use_cache: bool = True):
+        self.path = path
+        self.use_cache = use_cache
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self._history = None
+        self._sorted_history = None
+
+    def is_stale(self) -> bool:
+        """Check if the file changed since it was opened"""
+        stat = os.stat(self.path)
+        return stat.st_size != self.size or stat.st_mtime != self.mtime
+
+    def history(self, progress=None) -> pd.DataFrame:
+        """Return the parsed rows of the file, parsing it on first use"""
+        if self._history is None or self.is_stale():
+            stat = os.stat(self.path)
+            self.size = stat.st_size
+            self.mtime = stat.st_mtime
+            if self.use_cache:
+                from source.cache import cached_history
+                self._history = cached_history(self.path, progress)
+            else:
+                self._history = concat_histories(parse_chunks(self.path, history_chunksize(self.path), progress))
+            self._sorted_history = None
+        elif progress:
+            progress("rows", len(self._history))
+        return self._history
+
+    def memory_usage(self, progress=None) -> pd.DataFrame:
+        """Return the memory usage report of the parsed rows, see memory_usage_report"""
+        return memory_usage_report(self.history(progress))
+
+    def sorted_history(self, progress=None) -> tuple:
+        """Return the parsed rows sorted by time and their datetime64 times, sorting them on first use"""
+        history = self.history(progress)
+        if self._sorted_history is None:
+            self._sorted_history = sort_by_time(history)
+        return self._sorted_history
+
+    def analyze(
+            self, time_frame: int, custom_range=(None, None), details: bool = True, progress=None,
+            period_days: int = PERIOD_DAYS, fiscal_start: int = FISCAL_START
+        ) -> dict:
+        """Analyze the parsed rows of the file, a custom range only touches the rows inside it"""
+        if time_frame == 5:
+            return self.analyze_ranges([custom_range], details, progress)[custom_range]
+        return summarize_history(
+            [self.history(progress)], time_frame, custom_range, details, progress, period_days, fiscal_start
+        )
+
+    def analyze_frames(
+            self, time_frames=(1, 2, 3, 4), details: bool = True, progress=None,
+            period_days: int = PERIOD_DAYS, fiscal_start: int = FISCAL_START
+        ) -> dict:
+        """Analyze the parsed rows of the file for several time frames"""
+        return summarize_frames([self.history(progress)], time_frames, details, progress, period_days, fiscal_start)
+
+    def analyze_ranges(self, custom_ranges: list, details: bool = True, progress=None) -> dict:
+        """Analyze the parsed rows of several custom ranges, keyed by range"""
+        sorted_history, sorted_times = self.sorted_history(progress)
+        return {
+            custom_range: summarize_history(
+                [slice_range(sorted_history, sorted_times, custom_range)], 5, custom_range, details, progress
+            )
+            for custom_range in custom_ranges
+        }
+
+
+def write_html_head(f) -> None:
+    """Write the start of the html report up to the body"""
+    f.write(HTML_HEAD)
+
+
+def format_float_cells(values: np.ndarray) -> list:
+    """Format floats like the html export of pandas, every number with the fewest decimals the column needs"""
+    is_na = np.isnan(values)
+    is_number = np.isfinite(values)
+    cells = ['%.6f' % value for value in values]
+    numbers = int(is_number.sum())
+    if numbers:
+        # Trailing zeros are trimmed equally from every number, leaving at least one decimal
+        text = '\n'.join(cells) + '\n'
+        trim = 0
+        while trim < 5 and text.count('0' * (trim + 1) + '\n') == numbers:
+            trim += 1
+        if trim and numbers == len(cells):
+            cells = [cell[:-trim] for cell in cells]
+        elif trim:
+            cells = [cell[:-trim] if number else cell for cell, number in zip(cells, is_number)]
+
+    # Numbers that would be too long or show up as zero are written in scientific notation instead
+    magnitude = np.abs(values[~is_na])
+    too_long = max(map(len, cells), default=0) > 12
+    if ((magnitude < 1e-6) & (magnitude > 0)).any() or (too_long and (magnitude > 1e6).any()):
+        cells = ['%.6e' % value for value in values]
+    if is_na.any():
+        cells = ['' if na else cell for cell, na in zip(cells, is_na)]
+    return cells
 
-    return dataframes
 
+def escape_cells(cells: list) -> list:
+    """Escape the text of html cells, skipping the work if none of them needs it"""
+    text = ''.join(cells)
+    if '&' in text or '<' in text or '>' in text:
+        return [escape(cell, quote=False) for cell in cells]
+    return cells
 
-def export_html(dataframes: dict, export_location: str) -> None:
-    """Export the DataFrame to an HTML file"""
+
+def format_cells(column: pd.Series, formatter=None) -> list:
+    """Format the values of a column as the escaped text of its html cells, missing values are empty"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Every category is formatted once
+        categories = format_cells(pd.Series(column.cat.categories, dtype=object), formatter) + ['']
+        return [categories[code] for code in column.cat.codes.to_numpy()]
+    values = column.to_numpy()
+    if len(values) == 0:
+        # Only commissions were made in the intervals the column is cut for
+        return []
+    if formatter is None and values.dtype.kind == 'f':
+        return format_float_cells(values)
+    if values.dtype.kind == 'M' and formatter is DETAIL_FORMATTERS['Time']:
+        # The same text as the Time formatter, without a Timestamp for every value
+        text = np.char.replace(np.datetime_as_string(values, unit='s'), 'T', ' ')
+        return ['' if na else cell for cell, na in zip(text.tolist(), pd.isna(values))]
+    if values.dtype == np.float64 and formatter is not None:
+        # Every distinct number is formatted once, told apart by its bits so -0.0 isn't 0.0
+        bits, codes = np.unique(values.view(np.int64), return_inverse=True)
+        distinct = bits.view(np.float64)
+        cells = escape_cells(['' if na else formatter(value) for value, na in zip(distinct, np.isnan(distinct))])
+        return [cells[code] for code in codes.tolist()]
+    if values.dtype.kind == 'M':
+        values = column.astype(object).to_numpy()  # Timestamps for the formatter
+    if formatter is None:
+        # pandas writes None as text and only other missing values as empty cells
+        return escape_cells(['' if na and value is not None else str(value) for value, na in zip(values, pd.isna(values))])
+    return escape_cells(['' if na else formatter(value) for value, na in zip(values, pd.isna(values))])
+
+
+def table_cells(df: pd.DataFrame) -> list:
+    """Format the cells of every column of a table, with the detail formatters"""
+    return [format_cells(df[column], DETAIL_FORMATTERS.get(column)) for column in df.columns]
+
+
+def batch_float_cells(values: np.ndarray, bounds: np.ndarray) -> list:
+    """Format a float column for each interval between bounds like format_float_cells
+
+    Returns the cells of every interval, the bounds are positions in values. Whole cents below
+    1e7, like the rounded prices and balances of the trades, are formatted with the two or one
+    decimals they are trimmed to, without the '%.6f' text and trimming. Intervals with other
+    numbers are formatted by format_float_cells.
+    """
+    interval_cells = [[] for _ in range(len(bounds) - 1)]
+    nonempty = np.flatnonzero(bounds[:-1] < bounds[1:])
+    if len(nonempty) == 0:
+        return interval_cells
+    starts = bounds[nonempty]
+    is_na = np.isnan(values)
+    cents = np.rint(np.where(np.abs(values) < 1e7, values, 0.0) * 100)
+    is_cents = cents / 100 == values
+    all_cents = np.logical_and.reduceat(is_cents | is_na, starts)
+    all_tenths = np.logical_and.reduceat((cents % 10 == 0) | is_na, starts)
+    any_na = np.logical_or.reduceat(is_na, starts)
+    numbers = values.tolist()
+
+    for position, cents_only, tenths_only, na in zip(nonempty, all_cents, all_tenths, any_na):
+        start, stop = bounds[position], bounds[position + 1]
+        if not cents_only:
+            interval_cells[position] = format_float_cells(values[start:stop])
+            continue
+        template = '%.1f' if tenths_only else '%.2f'
+        if na:
+            interval_cells[position] = ['' if number != number else template % number for number in numbers[start:stop]]
+        else:
+            interval_cells[position] = [template % number for number in numbers[start:stop]]
+    return interval_cells
+
+
+@lru_cache(maxsize=64)
+def html_table_head(columns: tuple) -> str:
+    """Return the start of a table with the header of its columns up to the first row"""
+    header = ''.join(f'      <th>{escape(str(column), quote=False)}</th>\n' for column in columns)
+    return (
+        '<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: center;">\n'
+        f'{header}    </tr>\n  </thead>\n  <tbody>\n'
+    )
+
+
+def write_html_table(f, columns, rows) -> None:
+    """Write a table the way DataFrame.to_html(index=False, justify='center', border=1) does, row by row
+
+    The rows are the text of their cells, joined instead of formatted into a row template.
+    """
+    f.write(html_table_head(tuple(columns)))
+    if len(columns):
+        for row in rows:
+            f.write('    <tr>\n      <td>' + '</td>\n      <td>'.join(row) + '</td>\n    </tr>\n')
+    else:
+        for _ in rows:
+            f.write('    <tr>\n    </tr>\n')
+    f.write('  </tbody>\n</table>')
+
+
+def batch_detail_cells(trades: pd.DataFrame, bounds: np.ndarray) -> list:
+    """Format the details of every interval between bounds, each column of the trades formatted in one pass"""
+    trades = trades.iloc[bounds[0]:bounds[-1]]
+    bounds = bounds - bounds[0]
+    columns = []
+    for column in trades.columns:
+        values = trades[column]
+        if column not in DETAIL_FORMATTERS and values.dtype.kind == 'f':
+            # The decimals of a float column depend on the other values of the interval
+            columns.append(batch_float_cells(values.to_numpy(), bounds))
+        else:
+            cells = format_cells(values, DETAIL_FORMATTERS.get(column))
+            columns.append([cells[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])])
+    return list(zip(*columns))
+
+
+def write_report_intervals(f, report: IntervalReport, progress=None) -> None:
+    """Write the total and details tables of every interval from the arrays of the tables of the report
+
+    The trades are formatted in batches of about WRITE_BATCH_ROWS rows, so only the text of one
+    batch is held in memory while it is written.
+    """
+    total_rows = list(zip(*table_cells(report.totals.astype(object))))
+    details = report.trades is not None
+    if details:
+        columns = tuple(report.trades.columns)
+    batch_start = batch_stop = 0
+
+    for code, time_interval in enumerate(report):
+        f.write(f'<h1>{time_interval}</h1>\n')
+        f.write('<hr>\n')
+        with profile_stage("write html", 1):
+            write_html_table(f, report.totals.columns, total_rows[code:code + 1])
+        if details:
+            if code == batch_stop:
+                # Intervals up to WRITE_BATCH_ROWS trades past the start of the batch, at least one
+                batch_start = code
+                batch_stop = max(code + 1, np.searchsorted(
+                    report.bounds, report.bounds[code] + WRITE_BATCH_ROWS, side='right'
+                ) - 1)
+                batch = batch_detail_cells(report.trades, report.bounds[batch_start:batch_stop + 1])
+            cells = batch[code - batch_start]
+            with profile_stage("write html", len(cells[0])):
+                if cells[0]:
+                    write_html_table(f, columns, zip(*cells))
+                else:
+                    write_html_table(f, (), ())  # Only a commission was made in the interval
+        if progress:
+            progress("bytes", f.tell())
+
+
+def report_shards(report: IntervalReport, shards: int) -> list:
+    """Split the intervals of a report into contiguous shards of about the same number of rows, as (start, stop) codes"""
+    if report.trades is None:
+        edges = np.linspace(0, len(report), shards + 1).round().astype(int)
+    else:
+        # Every interval weighs its trades plus the row of its totals
+        rows = report.bounds + np.arange(len(report) + 1)
+        edges = np.searchsorted(rows, np.linspace(0, rows[-1], shards + 1))
+        edges[-1] = len(report)
+    edges = np.unique(edges)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def shard_tables(report: IntervalReport, start: int, stop: int) -> tuple:
+    """Return the totals, metrics, trades and bounds of the intervals from start to stop, all their html needs"""
+    totals = report.totals.iloc[start:stop]
+    metrics = report.metrics.iloc[start:stop]
+    if report.trades is None:
+        return totals, metrics, None, None
+    trades = report.trades.iloc[report.bounds[start]:report.bounds[stop]]
+    return totals, metrics, trades, report.bounds[start:stop + 1] - report.bounds[start]
+
+
+def render_report_intervals(tables: tuple) -> str:
+    """Return the html of the intervals of a shard, run by the workers of a parallel export
+
+    Only the tables of the shard are sent to the worker, the report is put together from them there.
+    """
+    f = io.StringIO()
+    write_report_intervals(f, IntervalReport(*tables))
+    return f.getvalue()
+
+
+def write_report_shards(f, report: IntervalReport, workers: int, progress=None) -> None:
+    """Render the intervals of a report in shards on a process pool and write the shards in order
+
+    Every shard is a contiguous run of intervals, so the html of every interval is the same as
+    written by write_report_intervals and the file is the same byte for byte.
+    """
+    shards = report_shards(report, workers * SHARDS_PER_WORKER)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        fragments = pool.map(render_report_intervals, (shard_tables(report, start, stop) for start, stop in shards))
+        for (start, stop), fragment in zip(shards, fragments):
+            rows = stop - start if report.trades is None else report.bounds[stop] - report.bounds[start]
+            with profile_stage("write html", int(rows)):
+                f.write(fragment)
+            if progress:
+                progress("bytes", f.tell())
+
+
+def write_html_intervals(f, dataframes: dict, progress=None, workers: int = None) -> None:
+    """Write the total and details tables of every interval, rendered by several processes if workers is over one"""
+    if isinstance(dataframes, IntervalReport) and list(dataframes) == list(dataframes.totals.index):
+        if workers and workers > 1 and len(dataframes) > 1:
+            write_report_shards(f, dataframes, workers, progress)
+        else:
+            write_report_intervals(f, dataframes, progress)
+        return
+
+    for time_frame in dataframes:
+        details_df = dataframes[time_frame].get("details")
+        total_df = dataframes[time_frame]["total"]
+        f.write(f'<h1>{time_frame}</h1>\n')
+        f.write('<hr>\n')
+        with profile_stage("write html", 1):
+            write_html_table(f, total_df.columns, zip(*table_cells(total_df)))
+        if details_df is not None:  # Totals only report
+            with profile_stage("write html", len(details_df)):
+                write_html_table(f, details_df.columns, zip(*table_cells(details_df)))
+        if progress:
+            progress("bytes", f.tell())
+
+
+def write_html_sections(f, reports: dict, progress=None, workers: int = None) -> None:
+    """Write the intervals of several reports, keyed by time frame or section title, each under a heading"""
+    for section, dataframes in reports.items():
+        f.write(f'<h1>{TIME_FRAME_NAMES.get(section, section)} Report</h1>\n')
+        write_html_intervals(f, dataframes, progress, workers)
+
+
+def write_breakdown_section(f, title: str, breakdown: pd.DataFrame) -> None:
+    """Write a symbol breakdown as a section with the table of every interval"""
+    f.write(f'<h1>{title}</h1>\n')
+    table = breakdown.drop(columns='Interval')
+    for column, template in TOTAL_FORMATS.items():
+        if column in table:
+            table[column] = [template.format(value) for value in table[column]]
+    rows = list(zip(*table_cells(table)))
+
+    # The rows of an interval are contiguous
+    intervals = breakdown['Interval'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, intervals[1:] != intervals[:-1]]) if len(intervals) else []
+    for start, stop in zip(starts, [*starts[1:], len(intervals)]):
+        f.write(f'<h2>{intervals[start]}</h2>\n')
+        write_html_table(f, table.columns, rows[start:stop])
+
+
+def write_breakdown_sections(f, reports: dict, by_position: bool = False) -> None:
+    """Write the symbol breakdown of every report with trade details, keyed by time frame or section title"""
+    kind = "Symbol and Position" if by_position else "Symbol"
+    for section, dataframes in reports.items():
+        if isinstance(dataframes, IntervalReport) and dataframes.trades is not None:
+            name = "" if section is None else f"{TIME_FRAME_NAMES.get(section, section)} "
+            write_breakdown_section(f, f"{name}Totals by {kind}", symbol_breakdown(dataframes, by_position))
+
+
+def open_report(export_location: str, compress: bool = None):
+    """Open an html report for writing through a large buffer, gzip compressed if compress or if it ends in .gz"""
+    if compress is None:
+        compress = export_location.endswith('.gz')
+    if compress:
+        return gzip.open(export_location, 'wt', compresslevel=6)
+    return open(export_location, 'w', buffering=WRITE_BUFFER_SIZE)
+
+
+def export_html(
+        dataframes: dict, export_location: str, progress=None, compress: bool = None, workers: int = None,
+        breakdown: bool = False, by_position: bool = False, equity: tuple = None
+    ) -> None:
+    """Export the DataFrame to an HTML file, progress is called as progress("bytes", count) after every interval
+
+    The file is gzip compressed if compress is True or, by default, if export_location ends in .gz.
+    With workers the intervals are rendered in shards by that many processes. With breakdown a
+    section with the totals of every symbol, or every symbol and position, of every interval follows.
+    equity is the rolling window in trades and in days of an equity and drawdown section, see analytics.
+    """
+    if os.path.exists(export_location):
+        os.remove(export_location)
+
+    with open_report(export_location, compress) as f:
+        write_html_head(f)
+        write_html_intervals(f, dataframes, progress, workers)
+        if breakdown:
+            write_breakdown_sections(f, {None: dataframes}, by_position)
+        if equity:
+            from source.analytics import write_equity_sections
+            write_equity_sections(f, {None: dataframes}, *equity)
+        f.write('</body>\n')
+        f.write('</html>\n')
+
+
+def export_html_frames(
+        reports: dict, export_location: str, progress=None, compress: bool = None, workers: int = None,
+        breakdown: bool = False, by_position: bool = False, equity: tuple = None
+    ) -> None:
+    """Export the DataFrames of several time frames, keyed by time frame or section title, to one HTML file
+
+    With breakdown the symbol breakdown and with equity the equity section of every time frame
+    follows, see export_html.
+    """
     if os.path.exists(export_location):
         os.remove(export_location)
-    
-    with open(export_location, 'w') as f:
-        f.write('<html>\n')
-        f.write('<head>\n')
-        f.write('<style>\n')
-        f.write('h1 {\n')
-        f.write('  margin-bottom: 0px;\n')
-        f.write('}\n')
-        f.write('table {\n')
-        f.write('  border-collapse: collapse;\n')
-        f.write('  width: 100%;\n')
-        f.write('}\n')
-        f.write('th, td {\n')
-        f.write('  text-align: left;\n')
-        f.write('  padding: 8px;\n')
-        f.write('}\n')
-        f.write('tr:nth-child(even) {\n')
-        f.write('  background-color: #f2f2f2;\n')
-        f.write('}\n')
-        f.write('th {\n')
-        f.write('  background-color: #4CAF50;\n')
-        f.write('  color: white;\n')
-        f.write('}\n')
-        f.write('</style>\n')
-        f.write('</head>\n')
-        f.write('<body>\n')
-        for time_frame in dataframes:
-            details_df = dataframes[time_frame]["details"]
-            total_df = dataframes[time_frame]["total"]
-            f.write(f'<h1>{time_frame}</h1>\n')
-            f.write('<hr>\n')
-            f.write(total_df.to_html(index=False, justify='center', border=1, bold_rows=True, na_rep=''))
-            f.write(details_df.to_html(index=False, justify='center', border=1, bold_rows=True, na_rep=''))
-            
+
+    with open_report(export_location, compress) as f:
+        write_html_head(f)
+        write_html_sections(f, reports, progress, workers)
+        if breakdown:
+            write_breakdown_sections(f, reports, by_position)
+        if equity:
+            from source.analytics import write_equity_sections
+            write_equity_sections(f, reports, *equity)
         f.write('</body>\n')
         f.write('</html>\n')
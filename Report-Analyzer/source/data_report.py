@@ -0,0 +1,325 @@
+"""
+Compact data driven html report
+
+Instead of the markup of a table for every interval, the report embeds the trades once as columnar
+json next to the totals of every section, and a small inline script renders the intervals of one
+page at a time. Sections of the same trades, like the time frames of one analysis, only list the
+positions of their trades in the shared table. The intervals can be filtered by name and paged
+through, the trades of every interval filtered by text and sorted by any column.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from source.csv_functions import DETAIL_FORMATTERS, REPORT_STYLE, TIME_FRAME_NAMES, IntervalReport, open_report
+
+# Intervals shown on a page of the report by default
+PAGE_SIZE = 25
+
+# Trades of an interval shown before more are asked for
+DETAIL_PAGE_SIZE = 100
+
+# Style of the controls of the report, on top of the style of the tables
+CONTROLS_STYLE = (
+    '#controls {\n'
+    '  position: sticky;\n'
+    '  top: 0;\n'
+    '  padding: 8px 0;\n'
+    '  background-color: white;\n'
+    '}\n'
+    '#controls input, #controls select, #controls button {\n'
+    '  margin-right: 8px;\n'
+    '}\n'
+    'th[data-column] {\n'
+    '  cursor: pointer;\n'
+    '}\n'
+)
+
+# Renders the intervals of the current page from the embedded report data
+RENDER_SCRIPT = r"""
+(function () {
+  'use strict';
+  var data = JSON.parse(document.getElementById('report-data').textContent);
+  var report = document.getElementById('report');
+  var controls = document.getElementById('controls');
+  var state = {section: 0, page: 0, pageSize: data.pageSize, intervals: '', trades: '', sort: null, descending: false, shown: {}};
+
+  function escapeHtml(text) {
+    return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+  }
+
+  function decodeColumn(column) {
+    var values = column.values;
+    if (column.kind === 'time') {
+      values = [];
+      var time = column.first;
+      for (var i = 0; i < column.count; i++) {
+        time += i ? column.deltas[i - 1] : 0;
+        values.push(time);
+      }
+      column.text = function (row) {
+        return new Date(values[row] * 1000).toISOString().slice(0, 19).replace('T', ' ');
+      };
+    } else if (column.kind === 'category') {
+      values = column.codes.map(function (code) { return code < 0 ? '' : column.categories[code]; });
+      column.text = function (row) { return values[row]; };
+    } else if (column.kind === 'number') {
+      column.text = function (row) {
+        var value = values[row];
+        if (value === null) return '';
+        return column.decimals === null ? String(value) : value.toFixed(column.decimals);
+      };
+    } else {
+      column.text = function (row) { return values[row] === null ? '' : values[row]; };
+    }
+    column.value = function (row) { return values[row]; };
+    return column;
+  }
+
+  data.tables.forEach(function (table) { table.columns = table.columns.map(decodeColumn); });
+
+  function tradeRows(section, table, interval) {
+    var rows = [];
+    for (var position = section.bounds[interval]; position < section.bounds[interval + 1]; position++) {
+      rows.push(section.rows === null ? position : section.rows[position]);
+    }
+    if (state.trades) {
+      var filter = state.trades.toLowerCase();
+      rows = rows.filter(function (row) {
+        return table.columns.some(function (column) {
+          return column.kind !== 'number' && column.text(row).toLowerCase().indexOf(filter) >= 0;
+        });
+      });
+    }
+    if (state.sort !== null) {
+      var column = table.columns[state.sort];
+      var direction = state.descending ? -1 : 1;
+      rows.sort(function (a, b) {
+        var x = column.value(a), y = column.value(b);
+        return x === y ? a - b : (x === null || x < y ? -direction : direction);
+      });
+    }
+    return rows;
+  }
+
+  function totalsTable(section, interval) {
+    var html = ['<table border="1"><thead><tr style="text-align: center;">'];
+    section.totals.columns.forEach(function (name) { html.push('<th>' + escapeHtml(name) + '</th>'); });
+    html.push('</tr></thead><tbody><tr>');
+    section.totals.rows[interval].forEach(function (value) { html.push('<td>' + escapeHtml(value) + '</td>'); });
+    html.push('</tr></tbody></table>');
+    return html.join('');
+  }
+
+  function detailsTable(section, table, interval) {
+    var rows = tradeRows(section, table, interval);
+    var shown = state.shown[interval] || data.detailPageSize;
+    var html = ['<table border="1"><thead><tr style="text-align: center;">'];
+    table.columns.forEach(function (column, index) {
+      var arrow = state.sort === index ? (state.descending ? ' &#9660;' : ' &#9650;') : '';
+      html.push('<th data-column="' + index + '">' + escapeHtml(column.name) + arrow + '</th>');
+    });
+    html.push('</tr></thead><tbody>');
+    rows.slice(0, shown).forEach(function (row) {
+      html.push('<tr>');
+      table.columns.forEach(function (column) { html.push('<td>' + escapeHtml(column.text(row)) + '</td>'); });
+      html.push('</tr>');
+    });
+    html.push('</tbody></table>');
+    if (rows.length > shown) {
+      html.push('<button data-more="' + interval + '">Show ' + Math.min(data.detailPageSize, rows.length - shown) +
+                ' more of ' + (rows.length - shown) + ' trades</button>');
+    }
+    return html.join('');
+  }
+
+  function render() {
+    var section = data.sections[state.section];
+    var table = section.table === null ? null : data.tables[section.table];
+    var filter = state.intervals.toLowerCase();
+    var intervals = [];
+    section.intervals.forEach(function (name, interval) {
+      if (name.toLowerCase().indexOf(filter) >= 0) intervals.push(interval);
+    });
+    var pages = Math.max(1, Math.ceil(intervals.length / state.pageSize));
+    state.page = Math.max(0, Math.min(state.page, pages - 1));
+
+    var html = section.title === null ? [] : ['<h1>' + escapeHtml(section.title) + '</h1>'];
+    intervals.slice(state.page * state.pageSize, (state.page + 1) * state.pageSize).forEach(function (interval) {
+      html.push('<h1>' + escapeHtml(section.intervals[interval]) + '</h1><hr>');
+      html.push(totalsTable(section, interval));
+      if (table) html.push(detailsTable(section, table, interval));
+    });
+    report.innerHTML = html.join('');
+    document.getElementById('page').textContent =
+      'Page ' + (state.page + 1) + ' of ' + pages + ', ' + intervals.length + ' intervals';
+  }
+
+  var sections = data.sections.map(function (section, index) {
+    return '<option value="' + index + '">' + escapeHtml(section.title === null ? 'Report' : section.title) + '</option>';
+  });
+  var sizes = [10, 25, 100, 500].map(function (size) {
+    return '<option' + (size === state.pageSize ? ' selected' : '') + '>' + size + '</option>';
+  });
+  controls.innerHTML =
+    (sections.length > 1 ? '<select id="section">' + sections.join('') + '</select>' : '') +
+    '<input id="intervals" placeholder="Filter intervals">' +
+    '<input id="trades" placeholder="Filter trades">' +
+    '<select id="page-size">' + sizes.join('') + '</select>' +
+    '<button id="previous">Previous</button><button id="next">Next</button><span id="page"></span>';
+
+  function listen(id, event, update) {
+    var element = document.getElementById(id);
+    if (element) element.addEventListener(event, function () { update(element); render(); });
+  }
+  listen('section', 'change', function (element) {
+    state.section = Number(element.value); state.page = 0; state.sort = null; state.shown = {};
+  });
+  listen('intervals', 'input', function (element) { state.intervals = element.value; state.page = 0; });
+  listen('trades', 'input', function (element) { state.trades = element.value; state.shown = {}; });
+  listen('page-size', 'change', function (element) { state.pageSize = Number(element.value); state.page = 0; });
+  listen('previous', 'click', function () { state.page -= 1; state.shown = {}; });
+  listen('next', 'click', function () { state.page += 1; state.shown = {}; });
+
+  report.addEventListener('click', function (event) {
+    var target = event.target;
+    if (target.hasAttribute('data-column')) {
+      var column = Number(target.getAttribute('data-column'));
+      state.descending = state.sort === column && !state.descending;
+      state.sort = column;
+    } else if (target.hasAttribute('data-more')) {
+      var interval = Number(target.getAttribute('data-more'));
+      state.shown[interval] = (state.shown[interval] || data.detailPageSize) + data.detailPageSize;
+    } else {
+      return;
+    }
+    render();
+  });
+  render();
+})();
+"""
+
+
+def json_values(values: np.ndarray) -> list:
+    """Return the values of a numeric column as a list with None for missing and infinite values"""
+    finite = np.isfinite(values)
+    if finite.all():
+        return values.tolist()
+    values = values.astype(object)
+    values[~finite] = None
+    return values.tolist()
+
+
+def encode_column(name: str, column: pd.Series) -> dict:
+    """Encode a column of the trades as compact json: times as deltas, categoricals as codes"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return {
+            'name': name, 'kind': 'category', 'categories': [str(category) for category in column.cat.categories],
+            'codes': column.cat.codes.tolist(),
+        }
+    if column.dtype.kind == 'M':
+        # Seconds of the naive times, successive trades are close together so the deltas are short
+        seconds = column.to_numpy().astype('datetime64[s]').astype(np.int64)
+        return {
+            'name': name, 'kind': 'time', 'count': len(seconds), 'first': int(seconds[0]) if len(seconds) else 0,
+            'deltas': np.diff(seconds).tolist(),
+        }
+    if column.dtype.kind in 'fiub':
+        # Columns with a formatter are shown like the text of the account history, the others with 2 decimals
+        return {
+            'name': name, 'kind': 'number', 'decimals': None if name in DETAIL_FORMATTERS else 2,
+            'values': json_values(column.to_numpy(dtype=np.float64)),
+        }
+    return {
+        'name': name, 'kind': 'text', 'values': [None if pd.isna(value) else str(value) for value in column],
+    }
+
+
+def same_trades(table: pd.DataFrame, trades: pd.DataFrame) -> bool:
+    """Check if an embedded table holds the same trades in the same order as the trades of a report"""
+    return table is trades or (len(table) == len(trades) and table.index.equals(trades.index) and table.equals(trades))
+
+
+def report_sections(reports: dict) -> tuple:
+    """Split the dataframes of every section into the trade tables to embed and the sections that refer to them
+
+    Returns the trade tables and the sections as json ready dicts, a section refers to its table by
+    position and lists the rows of its trades in interval order with the bounds of every interval.
+    """
+    tables = []
+    sections = []
+    for title, dataframes in reports.items():
+        intervals = list(dataframes)
+        section = {
+            'title': None if title is None else f"{TIME_FRAME_NAMES.get(title, title)} Report",
+            'intervals': [str(interval) for interval in intervals],
+            'table': None,
+        }
+
+        if isinstance(dataframes, IntervalReport) and intervals == list(dataframes.totals.index):
+            totals = dataframes.totals
+            if dataframes.source is not None:
+                # Reports of the same trades share one table, also when every report read the trades itself
+                position = next((i for i, table in enumerate(tables) if same_trades(table, dataframes.source)), None)
+                if position is None:
+                    tables.append(dataframes.source)
+                    position = len(tables) - 1
+                section.update(table=position, rows=dataframes.order.tolist(), bounds=dataframes.bounds.tolist())
+        else:
+            totals = pd.concat([dataframes[interval]['total'] for interval in intervals]) if intervals else None
+            details = [dataframes[interval].get('details') for interval in intervals]
+            if intervals and all(df is not None for df in details):
+                details = [df for df in details if len(df)]
+                tables.append(pd.concat(details, ignore_index=True) if details else pd.DataFrame())
+                bounds = np.cumsum([0] + [len(dataframes[interval]['details']) for interval in intervals])
+                section.update(table=len(tables) - 1, rows=None, bounds=bounds.tolist())
+
+        section['totals'] = {
+            'columns': [] if totals is None else [str(column) for column in totals.columns],
+            'rows': [] if totals is None else [[str(value) for value in row] for row in totals.to_numpy(dtype=object)],
+        }
+        sections.append(section)
+    return tables, sections
+
+
+def write_json(f, value) -> None:
+    """Write a value as json that is safe inside a script element"""
+    f.write(json.dumps(value, separators=(',', ':'), allow_nan=False).replace('</', '<\\/'))
+
+
+def export_data_report(reports: dict, export_location: str, progress=None, compress: bool = None) -> None:
+    """Export the DataFrames of several sections, keyed by time frame or section title, as a data driven html report
+
+    A key of None is a section without a title. progress is called as progress("bytes", count) after
+    every column and section, the file is gzip compressed like export_html does.
+    """
+    tables, sections = report_sections(reports)
+    with open_report(export_location, compress) as f:
+        f.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>Report</title>\n<style>\n')
+        f.write(REPORT_STYLE + CONTROLS_STYLE)
+        f.write('</style>\n</head>\n<body>\n<div id="controls"></div>\n<div id="report"></div>\n')
+        f.write('<script id="report-data" type="application/json">\n')
+        f.write(f'{{"pageSize":{PAGE_SIZE},"detailPageSize":{DETAIL_PAGE_SIZE},"tables":[')
+
+        # Every column is encoded and written on its own so only one is held as text at a time
+        for table_position, table in enumerate(tables):
+            f.write(',' if table_position else '')
+            f.write('{"columns":[')
+            for column_position, column in enumerate(table.columns):
+                f.write(',' if column_position else '')
+                write_json(f, encode_column(str(column), table[column]))
+                if progress:
+                    progress("bytes", f.tell())
+            f.write(']}')
+
+        f.write('],"sections":[')
+        for section_position, section in enumerate(sections):
+            f.write(',' if section_position else '')
+            write_json(f, section)
+            if progress:
+                progress("bytes", f.tell())
+        f.write(']}\n</script>\n<script>')
+        f.write(RENDER_SCRIPT)
+        f.write('</script>\n</body>\n</html>\n')
@@ -0,0 +1,124 @@
+"""
+Machine readable exports of the interval totals and trade details
+
+The totals keep their numeric types instead of the dollar and percentage text of the html report, so
+the files load into other tools without being parsed again. Every report is written as one totals
+and one details file, or partitioned by interval as a directory per report with a totals and a
+details file per interval. Every row starts with the interval it belongs to.
+"""
+
+import importlib.util
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from source.csv_functions import TIME_FRAME_NAMES, IntervalReport
+
+# File extension of every export format
+EXPORT_FORMATS = {
+    "parquet": ".parquet",
+    "csv": ".csv",
+    "jsonl": ".jsonl",
+}
+
+
+def file_name(name) -> str:
+    """Return a report or interval name that is safe to use as a file name"""
+    return re.sub(r'[^\w.-]+', '_', str(name)).strip('_')
+
+
+def parse_totals(totals: pd.DataFrame) -> pd.DataFrame:
+    """Turn formatted totals back into numbers, for reports that only have the formatted totals"""
+    return totals.apply(lambda column: pd.to_numeric(column.astype(str).str.strip('$%'), errors='coerce'))
+
+
+def report_tables(dataframes: dict) -> tuple:
+    """Return the numeric totals and the details of every interval of a report as two tables
+
+    Both tables start with an Interval column, the details are None for a totals only report. The
+    bounds are where the details of every interval start, followed by the end of the last.
+    """
+    intervals = list(dataframes)
+    names = [str(interval) for interval in intervals]
+    if isinstance(dataframes, IntervalReport) and intervals == list(dataframes.totals.index):
+        totals = dataframes.metrics.reset_index(drop=True)
+        details = None if dataframes.trades is None else dataframes.trades.reset_index(drop=True)
+        bounds = dataframes.bounds
+    else:
+        # A report put together by hand only has the tables of every interval
+        totals = parse_totals(pd.concat(
+            [dataframes[interval]['total'] for interval in intervals], ignore_index=True
+        )) if intervals else pd.DataFrame()
+        frames = [dataframes[interval].get('details') for interval in intervals]
+        details = bounds = None
+        if intervals and all(df is not None for df in frames):
+            bounds = np.cumsum([0] + [len(df) for df in frames])
+            nonempty = [df for df in frames if len(df)]
+            details = pd.concat(nonempty, ignore_index=True) if nonempty else pd.DataFrame()
+
+    totals.insert(0, 'Interval', names)
+    if details is not None:
+        details = details.copy(deep=False)
+        details.insert(0, 'Interval', np.repeat(np.array(names, dtype=object), np.diff(bounds)))
+    return totals, details, bounds
+
+
+def write_table(df: pd.DataFrame, path: str, file_format: str) -> None:
+    """Write a table as parquet, csv or json lines"""
+    if file_format == "parquet":
+        df.to_parquet(path, index=False)
+    elif file_format == "csv":
+        df.to_csv(path, index=False)
+    elif file_format == "jsonl":
+        df.to_json(path, orient='records', lines=True, date_format='iso')
+    else:
+        raise ValueError(f"Unknown export format: {file_format}")
+
+
+def export_tables(
+        reports: dict, directory: str, file_format: str = "csv", partition_by_interval: bool = False, progress=None
+    ) -> list:
+    """Export the numeric totals and details of the reports, keyed by time frame or title, and return the files written
+
+    Every report is written to <report>_totals and <report>_details, or partitioned by interval to
+    <report>/<interval>_totals and <report>/<interval>_details. progress is called as
+    progress("intervals", count) with the intervals written.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {file_format}")
+    if file_format == "parquet" and not any(importlib.util.find_spec(engine) for engine in ("pyarrow", "fastparquet")):
+        raise ValueError("Parquet exports need pyarrow: pip install pyarrow")
+    extension = EXPORT_FORMATS[file_format]
+    os.makedirs(directory, exist_ok=True)
+
+    written = []
+    count = 0
+    for report, dataframes in reports.items():
+        name = file_name(TIME_FRAME_NAMES.get(report, report)).lower()
+        totals, details, bounds = report_tables(dataframes)
+
+        if not partition_by_interval:
+            tables = [("totals", totals), ("details", details)]
+            for kind, table in tables:
+                if table is not None:
+                    written.append(os.path.join(directory, f"{name}_{kind}{extension}"))
+                    write_table(table, written[-1], file_format)
+            count += len(totals)
+            if progress:
+                progress("intervals", count)
+            continue
+
+        report_directory = os.path.join(directory, name)
+        os.makedirs(report_directory, exist_ok=True)
+        for position, interval in enumerate(totals['Interval']):
+            written.append(os.path.join(report_directory, f"{file_name(interval)}_totals{extension}"))
+            write_table(totals.iloc[position:position + 1], written[-1], file_format)
+            if details is not None:
+                written.append(os.path.join(report_directory, f"{file_name(interval)}_details{extension}"))
+                write_table(details.iloc[bounds[position]:bounds[position + 1]], written[-1], file_format)
+            count += 1
+            if progress:
+                progress("intervals", count)
+    return written
@@ -1,11 +1,13 @@
+import os
 import sys
-import time
 import re
-from source.csv_functions import analyze_data, export_html
+import queue
+import threading
+import calendar
+from typing import TYPE_CHECKING
 
 try:
     import tkinter as tk
-    import pandas as pd
     import subprocess
     import webbrowser
     from PIL import Image, ImageTk
@@ -15,6 +17,21 @@ except ImportError as e:
     input("\nPress ENTER to exit...")
     sys.exit()
 
+if TYPE_CHECKING:
+    from source.csv_functions import AccountHistory  # Imported when a file is picked, pandas loads slowly
+
+
+# What the count of every progress stage is shown as
+PROGRESS_LABELS = {
+    "rows": "rows parsed",
+    "intervals": "intervals aggregated",
+    "bytes": "bytes written",
+}
+
+
+class ExportCancelled(Exception):
+    """Raised on the worker thread to stop an export the user cancelled"""
+
 
 class GUI:
     """
@@ -31,16 +48,20 @@ class GUI:
         file_button_frame (tk.Frame): The frame that contains the file buttons
         version_frame (tk.Frame): The frame that contains the version label
         radio_var (tk.IntVar): The variable that stores the value of the radio buttons
+        period_days_var (tk.StringVar): The days of every interval of the N-day time frame
+        fiscal_start_var (tk.StringVar): The name of the month the fiscal year starts in
         account_history_path (str): The path to the account history csv file
+        account_history (AccountHistory): The validated account history, parsed once on the first export
         custom_date_range (tuple): The custom date range selected by the user
 
     Methods:
         hide_update_frame() -> None: Hide the update frame
         open_html(location: str) -> None: Open the html file in the default browser
-        is_valid_csv(file_path: str) -> bool: Check if the selected CSV file is valid
-        create_overlay(message: str) -> tk.Label: Create a semi-transparent overlay with a message in the center
+        is_valid_csv(file_path: str) -> AccountHistory: Check if the selected CSV file is valid and return a handle to it
+        loading_overlay(message: str, cancel_command) -> tk.Label: Create a semi-transparent overlay with a message and a cancel button
+        create_overlay(width: int, height: int) -> tk.Label: Create an overlay
         get_account_path() -> None: Open csv file and store path
-        export() -> None: Check if both csv files are selected, analyze data, and export html file
+        export() -> None: Check if both csv files are selected, analyze data, and export html file on a worker thread
         on_enter(event: tk.Event) -> None: Change button border when mouse hovers over it
         on_leave(event: tk.Event) -> None: Change button border back to normal when mouse leaves
         custom_time_window() -> None: Create a new window to select a custom time frame
@@ -84,7 +105,7 @@ class GUI:
         # Create the Tkinter root
         self.root = tk.Tk()
         self.root.title("Report Analyzer")
-        self.root.geometry("460x300")
+        self.root.geometry("560x360")
         self.root.resizable(False, False)
         self.root.iconphoto(False, tk.PhotoImage(data="iVBORw0KGgoAAAANSUhEUgAAACAAAAAgCAYAAABzenr0AAAACXBIWXMAAADsAAAA7AF5KHG9AAAAGXRFWHRTb2Z0d2FyZQB3d3cuaW5rc2NhcGUub3Jnm+48GgAABcVJREFUWIXdl21MnWcZx3/X/ZzDAc44QAuFUmSlY2tpm9qkbkvUOPuhjWmaJnaBw6A0Nk02M1+21EwX4wtqzYyZJM4YLV9cgEN5idYtmYlrls1orC+0SdW4TgqWQsvcAU4Pp4cD5zzPffmhgHAGzZljMfFKrg/Pfd3X/f/dL9dzPw/8j03eV7aqNJzlE0b5NLAfqELZiDCplhsinLeGcwPNcmHdARp69OPG8rzfYUtlEanKIu4N+MgzAlZhPsP8RIJrbycIuZa3xPJM73EZXBeAcLc+K4ZTO8pwQwUUj0xzbTrJRmvZoEJclGLHMLmxkFtbN1IbmyV6dZJCC1/va5GfvC+Axi5tD/g4+pFqqt+aZHhqlmJVfugYzp1tlivAna2JsFuEowY+X15IbFsZNYNjRDPKmf4WOf1fATRF9KQRvv1wDZWD44ylXV63eXxhoFFur5XTHNFSV+ko8LNv3xZq/jDKpAdP9rXIL94TQGunbsoYrjxcQ+HlCcZn05zrb5Vnwt36NEr9XVIv9R2joynCmaJ89m8vo/LPN0im5rj/5ZOSMLkCpB2+Wn4P0WiSt1MZ/rlzmK8shJ5DuCyGi9muwj8QvoWIhpJ8bibFrdsZ4qX5xPLzOQWQE8AnX1cf0FpXRt3INEXG8KW2NrEAKCIwpcr3Ft0qR3pbpCNg6dKFVe54QjICp4YmcR7YxDajnMgZYNNNPprnkEilSahl6Gyz/GV53MvjZUe4b9E1j4bVxultld+6HnFrsY5D4LEe3ePLBUBgV3GA5DuzpNTwanbcmeeAFb6x9JyGpm5Npy2PrzLcq9Ekhwr9pGfm2ZkTgMLmgA8nlcZFGcuOewF+R4YnlrcZi2t8RD2bNRnheipNusCPzqSoygnAKD65s5mrVo1vjr3W8NmVSmSsy+nsTbaKLs5KBckJACE65+Hl+3AEqrPDLlw1wsCKFMX1lJlViGsKAvhvJUmj3MwJwBMuxecI1ldQMh7nIPDNFWIO96ErD55CxghXNGssIxwsL2TLeIy4wN9zAgjO88eUn5JgHkXG4YFwp+7uOy5/WxLzGBZn5QqoUiuG7wPeYltjt37MCKWOwXE90n2tcjmnMnzxhMwpdI9MMbS1hIQ6tLe16VKuMRwWKF3hwg7gsCjPAzx+Rv1Ae10Z7lCUEYQXIcf3wMIsn/tXgspNRVQWOtS9Wcd3AcTwNZQPq2XfcseSEeFEX6u0oyozQV4I5bEhFKBkOsUGH/wAILdDCDgOjyiYwTGiD9VQMzhGS7hLy/0eT3Udl+RaeQ39WuxE6Aj4eGhPFR+6cJ2owhcjx2QGcryMmiL6GVVOWzgo8GSBj0P7qql58x2Gp2cJobQ7hp/3tMjIYs5jPbrDWh5FeKo8SKyujNqLY0xkXH7W2ypti/3WBGg6q1vV41mEDMoRPA70HWeoMcKPBA47QsGOCmzQT9HwNNdjKcrVco/CFEKZA/HSIFPbNlAbTzE1NElA4Tu9LfLCcp1VARq6dLsRXqsKMRu9TUHG0ld/lS9fqeOnCjt9cCgj7DXKj/0Ooc0h5iuLqA348Hl652DNW9ITca5NzBB0Pa5Zw6mBFvlTtta7AMKduhvD+e3luNUlVKdd3AujRF3lBkrC5nFk6QNEVcIRDgBHRXgEuFctASApwqgKr1nh3ECz/GatlV4B0BDRvY7y6/oKMptDbFlsn8vg/n6UGRH2Z9+E71q9fnUGGsW7W5/ltlSG4W590FHO76rAWy4O4FrmFBBlzU+vRXsv4rBQhuFufVCEV3ZV4FYUsXl5h5l5EhfHSKvydM+x/5zy9TIJd+puMbyxpwpbFqR8eTA+R/ziOJ61nOxvlV+utziAEYdPlRQQzRaPpYgNjuNZaP2gxAGMzxKJzRG8HmN0sXF6ltilG6hCuL9FfvVBicNCFTRH9H4P3thehg34Cfz1JsYzPHq38llXAIBwp9aLw0tqKbQODXf7ofy/sn8Dpxhpdb4xu1QAAAAASUVORK5CYII="))
 
@@ -119,49 +140,102 @@ class GUI:
         self.radio_var = tk.IntVar()
         self.radio_var.set(4)
         self.account_history_path = ""
+        self.account_history = None
         self.custom_date_range = (None, None)
+        self.period_days_var = tk.StringVar(value="7")
+        self.fiscal_start_var = tk.StringVar(value=calendar.month_name[1])
 
         # Create and label radio buttons
         report_title_label = tk.Label(self.radio_button_frame, text="Time Frame of Report")
         report_title_label.pack(side=tk.TOP, anchor=tk.N)
         report_title_label.config(font=self.theme["title_font"])
 
+        # A row of the calendar time frames, one of the time frames cut by day or week and one of the fiscal year
+        calendar_row = tk.Frame(self.radio_button_frame)
+        calendar_row.pack(side=tk.TOP)
+        period_row = tk.Frame(self.radio_button_frame)
+        period_row.pack(side=tk.TOP)
+        fiscal_row = tk.Frame(self.radio_button_frame)
+        fiscal_row.pack(side=tk.TOP)
+
         tk.Radiobutton(
-            self.radio_button_frame,
+            calendar_row,
             text="Daily",
             variable=self.radio_var,
             value=1,
             font=self.theme['normal_font']
         ).pack(side=tk.LEFT, anchor=tk.N)
         tk.Radiobutton(
-            self.radio_button_frame,
+            calendar_row,
             text="Monthly",
             variable=self.radio_var,
             value=2,
             font=self.theme['normal_font']
         ).pack(side=tk.LEFT, anchor=tk.N)
         tk.Radiobutton(
-            self.radio_button_frame,
+            calendar_row,
             text="Quarterly",
             variable=self.radio_var,
             value=3,
             font=self.theme['normal_font']
         ).pack(side=tk.LEFT, anchor=tk.N)
         tk.Radiobutton(
-            self.radio_button_frame,
+            calendar_row,
             text="Yearly",
             variable=self.radio_var,
             value=4,
             font=self.theme['normal_font']
         ).pack(side=tk.LEFT, anchor=tk.N)
         tk.Radiobutton(
-            self.radio_button_frame,
+            calendar_row,
             text="Custom",
             command=self.custom_time_window,
             variable=self.radio_var,
             value=5,
             font=self.theme['normal_font']
         ).pack(side=tk.LEFT, anchor=tk.N)
+        tk.Radiobutton(
+            period_row,
+            text="Weekly",
+            variable=self.radio_var,
+            value=6,
+            font=self.theme['normal_font']
+        ).pack(side=tk.LEFT, anchor=tk.N)
+        tk.Radiobutton(
+            period_row,
+            text="Days:",
+            variable=self.radio_var,
+            value=7,
+            font=self.theme['normal_font']
+        ).pack(side=tk.LEFT, anchor=tk.N)
+        tk.Spinbox(
+            period_row,
+            from_=1,
+            to=366,
+            width=4,
+            textvariable=self.period_days_var,
+            font=self.theme['normal_font']
+        ).pack(side=tk.LEFT, anchor=tk.N)
+        tk.Radiobutton(
+            period_row,
+            text="Hour of Day",
+            variable=self.radio_var,
+            value=8,
+            font=self.theme['normal_font']
+        ).pack(side=tk.LEFT, anchor=tk.N)
+        tk.Radiobutton(
+            period_row,
+            text="Weekday",
+            variable=self.radio_var,
+            value=9,
+            font=self.theme['normal_font']
+        ).pack(side=tk.LEFT, anchor=tk.N)
+
+        fiscal_label = tk.Label(fiscal_row, text="Fiscal Year Starts In", font=self.theme['small_font'])
+        fiscal_label.pack(side=tk.LEFT)
+        fiscal_menu = tk.OptionMenu(fiscal_row, self.fiscal_start_var, *calendar.month_name[1:])
+        fiscal_menu.config(font=self.theme['small_font'])
+        fiscal_menu.pack(side=tk.LEFT)
 
         # Account History button
         self.acc_button = tk.Button(
@@ -221,21 +295,17 @@ class GUI:
         else:
             webbrowser.open(location)
 
-    def is_valid_csv(self, file_path: str) -> bool:
-        """Check if the selected CSV file is valid"""
+    def is_valid_csv(self, file_path: str) -> 'AccountHistory':
+        """Check if the selected CSV file is valid and return a handle to it, None if it is not"""
+        from source.csv_functions import open_account_history  # pandas is only loaded once a file is picked
+
         try:
-            csv_file = pd.read_csv(file_path, sep=',')
-            for column in csv_file.columns:
-                if column not in ['Time', 'Balance Before', 'Balance After', 'Realized P&L (value)', 'Realized P&L (currency)', 'Action']:
-                    return False
-            return True
-        except Exception:
-            return False
-
-    def loading_overlay(
-            self, message: str, duration: int, delete_after_sleep: bool = False
-        ) -> tk.Label:
-        """Create a semi-transparent overlay with a message in the center"""
+            return open_account_history(file_path)
+        except (OSError, ValueError):
+            return None
+
+    def loading_overlay(self, message: str, cancel_command=None) -> tk.Label:
+        """Create a semi-transparent overlay with a message and an optional cancel button in the center"""
         width = self.root.winfo_width()
         height = self.root.winfo_height()
         image = Image.new('RGBA', (width, height), (128, 128, 128, 128))  # Semi-transparent grey
@@ -250,13 +320,19 @@ class GUI:
 
         label = tk.Label(overlay, text=message, font=self.theme['title_font'], bg="grey")
         label.place(relx=0.5, rely=0.5, anchor='c')
+        overlay.label = label  # Keep a reference to update the message
 
-        self.root.update()
-        time.sleep(duration)
+        if cancel_command:
+            cancel_button = tk.Button(overlay, text="Cancel", command=cancel_command)
+            cancel_button.configure(
+                bg=self.theme['expo_btn_disabled_bg'],
+                fg=self.theme['expo_btn_disabled_fg'],
+                font=self.theme['normal_font'],
+                width=10
+            )
+            cancel_button.place(relx=0.5, rely=0.7, anchor='c')
 
-        if delete_after_sleep:
-            overlay.destroy()
-            return None
+        self.root.update()
 
         return overlay
 
@@ -278,8 +354,10 @@ class GUI:
         if not csv_path:
             return
 
-        if self.is_valid_csv(csv_path):
+        account_history = self.is_valid_csv(csv_path)
+        if account_history:
             self.account_history_path = csv_path
+            self.account_history = account_history
             self.acc_button.configure(
                 bg=self.theme['acc_btn_active_bg'], fg=self.theme['acc_btn_active_fg']
             )
@@ -290,6 +368,7 @@ class GUI:
         else:
             tk.messagebox.showerror("Error", "Please select a valid 'Account History' file.")
             self.account_history_path = ""
+            self.account_history = None
             self.export_button.configure(
                 bg=self.theme['expo_btn_disabled_bg'],
                 disabledforeground=self.theme['expo_btn_disabled_fg']
@@ -297,8 +376,15 @@ class GUI:
             self.export_button.configure(state=tk.DISABLED)
 
     def export(self) -> None:
-        """Check if both csv files are selected, analyze data, and export html file"""
-        if not self.account_history_path:
+        """Check if both csv files are selected, then analyze data and export html file on a worker thread"""
+        if not self.account_history:
+            return
+        try:
+            period_days = int(self.period_days_var.get())
+        except ValueError:
+            period_days = 0
+        if period_days < 1:
+            tk.messagebox.showerror("Error", "Please enter a whole number of days of at least 1.")
             return
 
         export_location = filedialog.asksaveasfilename(
@@ -307,29 +393,78 @@ class GUI:
         if not export_location:
             return
 
-        overlay = self.loading_overlay("Exporting...", 1)
-        try:
-            data_frames = analyze_data(
-                self.account_history_path, self.radio_var.get(), self.custom_date_range
-            )
-        except Exception:
-            tk.messagebox.showerror("Error", "An error occurred while analyzing the data.")
-            overlay.destroy()
-            return
+        from source.csv_functions import export_html
+
+        cancel_event = threading.Event()
+        messages = queue.Queue()
+        overlay = self.loading_overlay("Exporting...", cancel_event.set)
+        self.export_button.configure(state=tk.DISABLED)
+        account_history = self.account_history
+        time_frame = self.radio_var.get()
+        custom_date_range = self.custom_date_range
+        fiscal_start = list(calendar.month_name).index(self.fiscal_start_var.get())
+
+        def progress(stage: str, count: int) -> None:
+            """Send the progress to the main thread and stop the job if it was cancelled"""
+            if cancel_event.is_set():
+                raise ExportCancelled()
+            messages.put(("progress", stage, count))
+
+        def work() -> None:
+            """Analyze the data and export the html file"""
+            try:
+                data_frames = account_history.analyze(
+                    time_frame, custom_date_range, progress=progress, period_days=period_days, fiscal_start=fiscal_start
+                )
+            except ExportCancelled:
+                messages.put(("cancelled",))
+                return
+            except Exception:
+                messages.put(("error", "An error occurred while analyzing the data."))
+                return
+
+            try:
+                export_html(data_frames, export_location, progress=progress)
+            except Exception as e:
+                if os.path.exists(export_location):  # Don't leave a partial report behind
+                    os.remove(export_location)
+                if isinstance(e, ExportCancelled):
+                    messages.put(("cancelled",))
+                else:
+                    messages.put(("error", "An error occurred while exporting the HTML file."))
+                return
+            messages.put(("done",))
+
+        def poll() -> None:
+            """Show the progress of the worker and finish the export once it is done"""
+            status = {}
+            result = None
+            while not messages.empty():
+                message = messages.get()
+                if message[0] == "progress":
+                    status[message[1]] = message[2]
+                else:
+                    result = message
+
+            if status:
+                overlay.label.configure(text="Exporting...\n" + "\n".join(
+                    f"{count:,} {PROGRESS_LABELS[stage]}" for stage, count in status.items()
+                ))
+            if result is None:
+                self.root.after(100, poll)
+                return
 
-        try:
-            export_html(data_frames, export_location)
             overlay.destroy()
-            if tk.messagebox.askyesno(
+            self.export_button.configure(state=tk.NORMAL)
+            if result[0] == "error":
+                tk.messagebox.showerror("Error", result[1])
+            elif result[0] == "done" and tk.messagebox.askyesno(
                 "Success", "HTML file exported successfully. Do you want to open it?"
                 ):
                 self.open_html(export_location)
-        except Exception:
-            tk.messagebox.showerror("Error", "An error occurred while exporting the HTML file.")
-            overlay.destroy()
-            return
 
-        overlay.destroy()
+        threading.Thread(target=work, daemon=True).start()
+        self.root.after(100, poll)
 
     def custom_time_window(self) -> None:
         """Create an overlay to select a custom time frame"""
@@ -0,0 +1,156 @@
+"""
+FIFO position ledger of the trades
+
+Every 'Enter position' commission row of the account history opens a lot of its symbol and every
+closed trade takes the oldest lots of its symbol first, a lot that is bigger than what is left to
+close is taken partially and the rest of it stays open. The lots of a symbol aren't kept in a
+queue that is popped row by row: they are laid out end to end on the cumulative quantity entered,
+every close takes the next stretch of it, and the lots a close took are found with a binary search.
+A close that takes more than is open, e.g. of a position entered before the history starts, leaves
+the rest of its quantity unmatched. The ledger of millions of fills is a handful of array passes.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from source.csv_functions import ACTION_PATTERN, IntervalReport, read_chunks
+
+# Fields of an 'Enter position' commission action
+ENTRY_PATTERN = re.compile(
+    r"Enter position for symbol (?P<Symbol>\w+:\w+)"
+    r" at price (?P<Price>\d+(?:\.\d+)?)"
+    r" for (?P<Quantity>\d+(?:\.\d+)?) shares"
+)
+
+# Quantities are matched as whole millionths of a share, so fractional lots add up exactly
+QUANTITY_SCALE = 10 ** 6
+
+# Columns the ledger adds to the trade details of a report
+LEDGER_COLUMNS = ['Opened', 'Opened Price', 'Holding Days', 'P&L per Share']
+
+
+def ledger_fills(account_df: pd.DataFrame) -> pd.DataFrame:
+    """Return the entries and closes of a chunk of the account history, keyed by row
+
+    Position is empty for an entry, the side of a position is only known once it is closed.
+    """
+    actions = account_df['Action']
+    is_entry = actions.str.contains("Enter position", regex=False).to_numpy()
+    entries = actions[is_entry].str.extract(ENTRY_PATTERN).dropna()
+    closes = actions[~is_entry].str.extract(ACTION_PATTERN).dropna()
+    fills = pd.concat([
+        pd.DataFrame({
+            'Position': None, 'Symbol': entries['Symbol'], 'Price': entries['Price'],
+            'Quantity': entries['Quantity'],
+        }),
+        pd.DataFrame({
+            'Position': closes['Position'], 'Symbol': closes['Symbol'], 'Price': closes['Closed_Price'],
+            'Quantity': closes['Quantity'],
+        }),
+    ]).sort_index()
+    fills.insert(0, 'Time', pd.to_datetime(account_df['Time'][fills.index], format='ISO8601'))
+    fills['Price'] = fills['Price'].astype(float)
+    fills['Quantity'] = fills['Quantity'].astype(float)
+    return fills
+
+
+def match_fills(fills: pd.DataFrame) -> pd.DataFrame:
+    """Match every close with the lots it closed, first in first out per symbol, and return the ledger of the closes
+
+    The fills are in the order of the account history, newest first. The ledger is keyed by the
+    row of every close: the time the first lot it closed was opened, the average price and
+    holding days of the quantity it closed weighted by quantity, the P&L per share and the
+    quantity that had no open lot. The values of a close without any open lot are missing.
+    """
+    # Oldest first, fills of the same time in the reverse order of the history, grouped by symbol
+    symbols, _ = pd.factorize(fills['Symbol'])
+    positions = np.arange(len(fills))
+    times = fills['Time'].to_numpy()
+    order = np.lexsort((-positions, times, symbols))
+    symbols = symbols[order]
+    times = times[order]
+    prices = fills['Price'].to_numpy()[order]
+    quantities = np.round(fills['Quantity'].to_numpy()[order] * QUANTITY_SCALE).astype(np.int64)
+    is_entry = fills['Position'].isna().to_numpy()[order]
+
+    # The quantity entered and closed so far, of all symbols before and of the symbol itself
+    entered = np.cumsum(np.where(is_entry, quantities, 0))
+    closed = np.cumsum(np.where(is_entry, 0, quantities))
+    group_starts = np.flatnonzero(np.diff(symbols, prepend=-1))
+    group_sizes = np.diff(np.append(group_starts, len(symbols)))
+    entered_before = np.repeat(entered[group_starts] - np.where(is_entry, quantities, 0)[group_starts], group_sizes)
+    closed_before = np.repeat(closed[group_starts] - np.where(is_entry, 0, quantities)[group_starts], group_sizes)
+    symbol_entered = entered - entered_before
+    symbol_closed = closed - closed_before
+
+    # The quantity taken from the lots: a close takes what it closes but never more than was entered,
+    # the deepest shortfall so far is the quantity that had no lot
+    shortfall = pd.Series(np.minimum(symbol_entered - symbol_closed, 0)).groupby(symbols).cummin().to_numpy()
+    taken = symbol_closed + shortfall
+    taken_before = np.roll(taken, 1)
+    taken_before[group_starts] = 0
+
+    closes = np.flatnonzero(~is_entry)
+    starts = entered_before[closes] + taken_before[closes]
+    ends = entered_before[closes] + taken[closes]
+    matched = ends - starts
+
+    # The lots every close took, as one piece per close and lot
+    lot_ends = entered[is_entry]
+    lot_starts = lot_ends - quantities[is_entry]
+    lot_prices = prices[is_entry]
+    lot_times = times[is_entry]
+    has_lots = matched > 0
+    first_lots = np.searchsorted(lot_ends, starts[has_lots], side='right')
+    last_lots = np.searchsorted(lot_ends, ends[has_lots], side='left')
+    piece_counts = last_lots - first_lots + 1
+    piece_offsets = np.cumsum(piece_counts) - piece_counts
+    piece_lots = np.arange(piece_counts.sum()) - np.repeat(piece_offsets - first_lots, piece_counts)
+    piece_quantities = (
+        np.minimum(np.repeat(ends[has_lots], piece_counts), lot_ends[piece_lots])
+        - np.maximum(np.repeat(starts[has_lots], piece_counts), lot_starts[piece_lots])
+    ).astype(float)
+    piece_days = (np.repeat(times[closes][has_lots], piece_counts) - lot_times[piece_lots]) / np.timedelta64(1, 'D')
+
+    def weighted(values: np.ndarray) -> np.ndarray:
+        # Quantity weighted average of the pieces of every close, NaN for a close without lots
+        result = np.full(len(closes), np.nan)
+        result[has_lots] = np.add.reduceat(values * piece_quantities, piece_offsets) / matched[has_lots]
+        return result
+
+    opened = np.full(len(closes), np.datetime64('NaT'), dtype=times.dtype)
+    opened[has_lots] = lot_times[first_lots]
+    opened_price = weighted(lot_prices[piece_lots])
+    is_long = (fills['Position'].to_numpy()[order][closes] == 'long')
+    per_share = np.where(is_long, prices[closes] - opened_price, opened_price - prices[closes])
+
+    return pd.DataFrame({
+        'Opened': opened,
+        'Opened Price': opened_price.round(2),
+        'Holding Days': weighted(piece_days).round(2),
+        'P&L per Share': per_share.round(2),
+        'Unmatched Quantity': (quantities[closes] - matched) / QUANTITY_SCALE,
+    }, index=fills.index[order][closes]).sort_index()
+
+
+def position_ledger(account_history_path: str, chunksize: int = None, progress=None) -> pd.DataFrame:
+    """Read the fills of an account history and return the FIFO ledger of its closes, keyed by row, see match_fills"""
+    fills = []
+    rows = 0
+    for account_df in read_chunks(account_history_path, chunksize):
+        fills.append(ledger_fills(account_df))
+        rows += len(account_df)
+        if progress:
+            progress("rows", rows)
+    return match_fills(pd.concat(fills))
+
+
+def add_ledger_columns(report: IntervalReport, ledger: pd.DataFrame) -> None:
+    """Add the ledger of every trade of a report to its trade details"""
+    if report.trades is None:
+        raise ValueError("The position ledger needs the trade details")
+    rows = report.source.index[report.order]
+    for column in LEDGER_COLUMNS:
+        report.trades[column] = ledger[column].reindex(rows).to_numpy()
@@ -0,0 +1,85 @@
+"""
+Stage level profiling of the analysis and the html export
+
+A Profiler collects the stages csv_functions reports through set_profile_callback and sums them up
+per stage, the summary shows where an export spends its time and the trace can be written as json.
+"""
+
+import json
+import time
+import tracemalloc
+
+from source.csv_functions import set_profile_callback
+
+
+class Profiler:
+    """
+    Collects the profiled stages of the analysis while it is active
+
+    Attributes:
+        trace_memory (bool): Trace allocations with tracemalloc to measure the memory change of every stage
+        events (list): Every reported stage as a dict of stage, start, seconds, rows and memory
+
+    Methods:
+        summary() -> list: Return the totals of every stage, slowest first
+        format_summary() -> str: Return the summary as a table
+        write_json(path: str) -> None: Write the events and the summary as a json trace
+    """
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.events = []
+        self._start = 0.0
+        self._started_tracing = False
+
+    def __enter__(self) -> 'Profiler':
+        self._start = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        set_profile_callback(self)
+        return self
+
+    def __exit__(self, *_) -> None:
+        set_profile_callback(None)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __call__(self, stage: str, seconds: float, rows: int, memory: int) -> None:
+        """Record one profiled stage"""
+        self.events.append({
+            'stage': stage,
+            'start': time.perf_counter() - seconds - self._start,
+            'seconds': seconds,
+            'rows': rows,
+            'memory': memory,
+        })
+
+    def summary(self) -> list:
+        """Return the totals of every stage, slowest first"""
+        stages = {}
+        for event in self.events:
+            total = stages.setdefault(event['stage'], {
+                'stage': event['stage'], 'calls': 0, 'seconds': 0.0, 'rows': 0, 'memory': None
+            })
+            total['calls'] += 1
+            total['seconds'] += event['seconds']
+            total['rows'] += event['rows']
+            if event['memory'] is not None:
+                total['memory'] = (total['memory'] or 0) + event['memory']
+        return sorted(stages.values(), key=lambda total: total['seconds'], reverse=True)
+
+    def format_summary(self) -> str:
+        """Return the summary as a table"""
+        lines = [f"{'Stage':<18} {'Calls':>8} {'Seconds':>10} {'Rows':>12} {'Memory':>12}"]
+        for total in self.summary():
+            memory = "" if total['memory'] is None else f"{total['memory'] / 1024 ** 2:+.1f} MB"
+            lines.append(
+                f"{total['stage']:<18} {total['calls']:>8,} {total['seconds']:>10.4f} {total['rows']:>12,} {memory:>12}"
+            )
+        return "\n".join(lines)
+
+    def write_json(self, path: str) -> None:
+        """Write the events and the summary as a json trace"""
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'events': self.events}, f, indent=2)
@@ -0,0 +1,270 @@
+"""
+Local http server of reports on demand
+
+The account history is parsed once and every report is analyzed and rendered when it is first asked
+for, for example /report?frame=monthly, /report?frame=n-day&days=14 or
+/report?start=2020-01-01&end=2020-06-30. The analyzed reports and the rendered pages are kept in
+bounded least recently used caches, so a report that is asked for again is served without being
+analyzed or rendered. Both caches are emptied when the csv file changes, the file is then parsed
+again on the next request.
+"""
+
+import io
+import json
+import threading
+from collections import OrderedDict
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from source.cli import ALL_TIME_FRAMES, TIME_FRAMES as COMMAND_LINE_TIME_FRAMES
+from source.csv_functions import (
+    HTML_HEAD, PERIOD_DAYS, TIME_FRAME_NAMES, open_account_history, slice_range, summarize_history, write_html_intervals,
+    write_html_sections
+)
+
+# Time frame names of the query string, those of the command line but custom, which a date range asks for
+TIME_FRAMES = {name: time_frame for name, time_frame in COMMAND_LINE_TIME_FRAMES.items() if time_frame != 5}
+
+# Analyzed reports and rendered pages kept in the caches
+CACHE_ENTRIES = 32
+
+# Total size of the rendered pages kept in the cache
+CACHE_BYTES = 256 * 1024 ** 2
+
+
+class LRUCache:
+    """
+    A bounded mapping that evicts the least recently used entries
+
+    Attributes:
+        max_entries (int): The number of entries kept at most
+        max_bytes (int): The total size of the entries kept at most, None to only limit the entries
+        size (callable): Returns the size of a value, used with max_bytes
+        hits (int): The number of lookups that found their entry
+        misses (int): The number of lookups that didn't
+
+    Methods:
+        get(key) -> object: Return the value of a key and mark it as used, None if it isn't cached
+        put(key, value) -> None: Cache a value, evicting the least recently used entries over the limits
+        clear() -> None: Remove every entry
+    """
+    def __init__(self, max_entries: int = CACHE_ENTRIES, max_bytes: int = None, size=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the value of a key and mark it as used, None if it isn't cached"""
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value) -> None:
+        """Cache a value, evicting the least recently used entries over the limits"""
+        if key in self._entries:
+            self._bytes -= self._value_size(self._entries.pop(key))
+        self._entries[key] = value
+        self._bytes += self._value_size(value)
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= self._value_size(evicted)
+
+    def clear(self) -> None:
+        """Remove every entry"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def _value_size(self, value) -> int:
+        return 0 if self.max_bytes is None else self.size(value)
+
+
+def parse_view(query: str) -> tuple:
+    """Return the time frames, date range, details and n-day interval days of the report a query string asks for
+
+    frame is daily, monthly, quarterly, yearly, weekly, n-day, hour-of-day, weekday or all, start and end are a date
+    range, details=0 leaves the trade details out and days is the length of the n-day intervals. A date range without
+    a frame is reported as a custom time frame.
+    """
+    parameters = {name: values[-1] for name, values in parse_qs(query).items()}
+    start, end = parameters.get("start") or None, parameters.get("end") or None
+    if (start is None) != (end is None):
+        raise ValueError("A date range needs both start and end")
+    frame = parameters.get("frame", "custom" if start else "yearly")
+    if frame == "all":
+        time_frames = ALL_TIME_FRAMES
+    elif frame == "custom" and start:
+        time_frames = (5,)
+    elif frame in TIME_FRAMES:
+        time_frames = (TIME_FRAMES[frame],)
+    else:
+        raise ValueError(f"Unknown time frame: {frame}")
+    details = parameters.get("details", "1") not in ("0", "false", "no")
+    period_days = PERIOD_DAYS
+    if 7 in time_frames:
+        try:
+            period_days = int(parameters.get("days", PERIOD_DAYS))
+        except ValueError:
+            period_days = 0
+        if period_days < 1:
+            raise ValueError("days must be a whole number of days of at least 1")
+    return time_frames, (start, end), details, period_days
+
+
+class ReportServer:
+    """
+    Analyzes and renders the reports of one account history on demand, with caches of both
+
+    Attributes:
+        account_history (AccountHistory): The account history the reports are made from
+        reports (LRUCache): The analyzed reports, keyed by view
+        pages (LRUCache): The rendered pages, keyed by view
+
+    Methods:
+        analyze(view: tuple) -> dict: Return the reports of a view, keyed by time frame
+        page(view: tuple) -> tuple: Return the html of a view and whether it came from the cache
+        totals(view: tuple) -> bytes: Return the numeric totals of a view as json
+        serve(host: str, port: int) -> None: Serve the reports over http until interrupted
+    """
+    def __init__(
+            self, account_history_path: str, use_cache: bool = True,
+            cache_entries: int = CACHE_ENTRIES, cache_bytes: int = CACHE_BYTES
+        ):
+        self.account_history = open_account_history(account_history_path, use_cache=use_cache)
+        self.account_history.history()  # Parsed once up front instead of on the first request
+        self.reports = LRUCache(cache_entries)
+        self.pages = LRUCache(cache_entries, cache_bytes)
+        self._lock = threading.Lock()
+
+    def invalidate_if_changed(self) -> None:
+        """Empty the caches if the csv file changed, it's parsed again on the next analysis"""
+        if self.account_history.is_stale():
+            self.reports.clear()
+            self.pages.clear()
+
+    def analyze(self, view: tuple) -> dict:
+        """Return the reports of a view, keyed by time frame, from the cache if it was analyzed before"""
+        reports = self.reports.get(view)
+        if reports is not None:
+            return reports
+
+        time_frames, custom_range, details, period_days = view
+        if time_frames == (5,):
+            reports = {5: self.account_history.analyze(5, custom_range, details)}
+        elif custom_range != (None, None):
+            # Only the rows of the range are summarized, cut out of the time sorted rows
+            sorted_history, sorted_times = self.account_history.sorted_history()
+            rows = slice_range(sorted_history, sorted_times, custom_range)
+            reports = {
+                time_frame: summarize_history([rows], time_frame, details=details, period_days=period_days)
+                for time_frame in time_frames
+            }
+        elif len(time_frames) == 1:
+            reports = {
+                time_frames[0]: self.account_history.analyze(time_frames[0], details=details, period_days=period_days)
+            }
+        else:
+            reports = self.account_history.analyze_frames(time_frames, details, period_days=period_days)
+        self.reports.put(view, reports)
+        return reports
+
+    def page(self, view: tuple) -> tuple:
+        """Return the html of a view as bytes and whether it came from the cache"""
+        with self._lock:
+            self.invalidate_if_changed()
+            page = self.pages.get(view)
+            if page is not None:
+                return page, True
+
+            reports = self.analyze(view)
+            f = io.StringIO()
+            f.write(HTML_HEAD)
+            if len(reports) == 1:
+                write_html_intervals(f, next(iter(reports.values())))
+            else:
+                write_html_sections(f, reports)
+            f.write('</body>\n')
+            f.write('</html>\n')
+            page = f.getvalue().encode('utf-8')
+            self.pages.put(view, page)
+            return page, False
+
+    def totals(self, view: tuple) -> bytes:
+        """Return the numeric totals of every interval of a view as json, keyed by time frame name"""
+        with self._lock:
+            self.invalidate_if_changed()
+            reports = self.analyze(view)
+            return json.dumps({
+                TIME_FRAME_NAMES[time_frame]: {
+                    str(interval): metrics
+                    for interval, metrics in dataframes.metrics.astype(object).where(
+                        dataframes.metrics.notna(), None
+                    ).to_dict(orient='index').items()
+                } if dataframes else {}
+                for time_frame, dataframes in reports.items()
+            }).encode('utf-8')
+
+    def index_page(self) -> bytes:
+        """Return the start page with a link to every time frame and a form for a date range"""
+        links = ''.join(
+            f'<li><a href="/report?frame={frame}">{frame.capitalize()}</a></li>\n' for frame in [*TIME_FRAMES, "all"]
+        )
+        return (
+            f'{HTML_HEAD}<h1>{escape(self.account_history.path)}</h1>\n<ul>\n{links}</ul>\n'
+            '<form action="/report">\n'
+            '<input type="date" name="start" required> to <input type="date" name="end" required>\n'
+            '<input type="submit" value="Report">\n'
+            '</form>\n</body>\n</html>\n'
+        ).encode('utf-8')
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        """Serve the reports over http until interrupted"""
+        server = ThreadingHTTPServer((host, port), request_handler(self))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+def request_handler(report_server: ReportServer) -> type:
+    """Return the request handler class of a report server"""
+    class ReportRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            try:
+                if url.path == "/":
+                    self.send_body(report_server.index_page(), "text/html")
+                elif url.path == "/report":
+                    page, cached = report_server.page(parse_view(url.query))
+                    self.send_body(page, "text/html", {"X-Cache": "hit" if cached else "miss"})
+                elif url.path == "/totals":
+                    self.send_body(report_server.totals(parse_view(url.query)), "application/json")
+                else:
+                    self.send_error(404)
+            except ValueError as e:
+                self.send_error(400, str(e))
+            except OSError as e:
+                self.send_error(500, str(e))
+
+        def send_body(self, body: bytes, content_type: str, headers: dict = None) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ReportRequestHandler
@@ -0,0 +1,273 @@
+"""
+Local SQLite store of account history rows
+
+Account history exports are ingested into one SQLite database, so overlapping exports build up a
+single history. Every row is keyed by a hash of its time, balances, value and action: a row that
+is already stored is skipped, so a later ingest of an overlapping export only inserts its new rows
+and a file that is unchanged since it was ingested isn't read at all. The rows are indexed on time
+and on symbol and time, the interval sums of a report are aggregated by SQLite and only the trades
+of the report are read back.
+"""
+
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from source.csv_functions import (
+    CHUNK_SIZE, DETAIL_COLUMNS, POSITIONS, build_dataframes, clean_balance, open_account_history,
+    parse_account_history, parse_custom_range, read_chunks
+)
+
+# Symbol of a commission row, which parse_account_history leaves empty
+COMMISSION_SYMBOL_PATTERN = re.compile(r"symbol (\w+:\w+)")
+
+# The numbers have no column type: a REAL column stores whole numbers as integers, which turns the
+# -0.0 of a rounded loss into 0.0 and the report would show 0.00 instead of -0.00
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    row_key INTEGER NOT NULL UNIQUE,
+    time TEXT NOT NULL,
+    position TEXT,
+    symbol TEXT,
+    quantity,
+    closed_price,
+    balance_before,
+    balance_after,
+    profit,
+    percent,
+    commission
+);
+CREATE INDEX IF NOT EXISTS history_time ON history (time);
+CREATE INDEX IF NOT EXISTS history_symbol_time ON history (symbol, time);
+CREATE TABLE IF NOT EXISTS ingests (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    rows INTEGER NOT NULL,
+    inserted INTEGER NOT NULL,
+    ingested REAL NOT NULL
+);
+"""
+
+# Columns of the history table in the order of the parsed rows
+STORE_COLUMNS = [
+    'time', 'position', 'symbol', 'quantity', 'closed_price', 'balance_before', 'balance_after', 'profit', 'percent',
+    'commission'
+]
+
+# SQL expression of the interval of a row for every time frame, times are stored as 'YYYY-MM-DD HH:MM:SS'
+INTERVAL_SQL = {
+    1: "substr(time, 1, 10)",
+    2: "substr(time, 1, 7)",
+    3: "substr(time, 1, 4) || '-Q' || ((CAST(substr(time, 6, 2) AS INTEGER) + 2) / 3)",
+    4: "substr(time, 1, 4)",
+    5: "substr(time, 1, 10)",
+}
+
+# The sums interval_sums aggregates, as SQL over the rows of an interval. The amounts are rounded to cents,
+# summing them as whole cents is exact whatever order SQLite reads the rows in
+SUMS_SQL = """
+SELECT {interval} AS interval,
+    COUNT(profit) AS "Number of Trades",
+    COUNT(CASE WHEN position = 'long' THEN 1 END) AS "Number of Long Trades",
+    COUNT(CASE WHEN position = 'short' THEN 1 END) AS "Number of Short Trades",
+    COUNT(CASE WHEN profit > 0 THEN 1 END) AS "Number of Wins",
+    COUNT(CASE WHEN profit < 0 THEN 1 END) AS "Number of Losses",
+    TOTAL(CAST(round(percent * 100) AS INTEGER)) / 100 AS "Total Return",
+    TOTAL(CASE WHEN profit > 0 THEN CAST(round(percent * 100) AS INTEGER) END) / 100 AS "Win Return",
+    TOTAL(CASE WHEN profit < 0 THEN CAST(round(percent * 100) AS INTEGER) END) / 100 AS "Loss Return",
+    TOTAL(CAST(round(profit * 100) AS INTEGER)) / 100 AS "Net Profit",
+    TOTAL(CASE WHEN profit > 0 THEN CAST(round(profit * 100) AS INTEGER) END) / 100 AS "Gross Profit",
+    TOTAL(CASE WHEN profit < 0 THEN CAST(round(profit * 100) AS INTEGER) END) / 100 AS "Gross Loss",
+    TOTAL(CAST(round(commission * 100) AS INTEGER)) / 100 AS "Commission"
+FROM history {where}
+GROUP BY interval
+ORDER BY MAX(time) DESC
+"""
+
+
+# The trades of a report, newest first like the account history export
+TRADES_SQL = """
+SELECT {interval} AS interval, time, position, symbol, quantity, closed_price, balance_before, balance_after,
+    profit, percent
+FROM history {where} {conjunction} profit IS NOT NULL
+ORDER BY time DESC, id
+"""
+
+
+def row_keys(account_df: pd.DataFrame, history: pd.DataFrame) -> np.ndarray:
+    """Return a 64 bit key of every row from its time, balances, value and action
+
+    The balances are hashed as numbers, so the same row has the same key whether its file was read
+    with or without thousands separators.
+    """
+    row_content = pd.DataFrame({
+        'time': history['Time'],
+        'balance_before': clean_balance(account_df['Balance Before']),
+        'balance_after': clean_balance(account_df['Balance After']),
+        'value': account_df['Realized P&L (value)'].astype(float),
+        'action': account_df['Action'].astype(str),
+    })
+    return pd.util.hash_pandas_object(row_content, index=False).to_numpy().view(np.int64)
+
+
+def store_rows(account_df: pd.DataFrame) -> list:
+    """Parse a chunk of the account history into the rows of the history table, missing values as None"""
+    history = parse_account_history(account_df)
+    rows = pd.DataFrame({
+        'row_key': row_keys(account_df, history),
+        'time': history['Time'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'position': history['Position'].astype(object),
+        'symbol': history['Symbol'].astype(object),
+        'quantity': history['Quantity'],
+        'closed_price': history['Closed Price'],
+        'balance_before': history['Balance Before'],
+        'balance_after': history['Balance After'],
+        'profit': history['P&L'],
+        'percent': history['%'],
+        'commission': history['Commission'],
+    })
+    # Commission rows keep their symbol so the store can be filtered by symbol
+    is_commission = history['Commission'].notna()
+    rows.loc[is_commission, 'symbol'] = account_df.loc[is_commission, 'Action'].str.extract(
+        COMMISSION_SYMBOL_PATTERN, expand=False
+    )
+    rows = rows.astype(object)
+    return list(rows.where(rows.notna(), None).itertuples(index=False, name=None))
+
+
+def date_keyed(sums: pd.DataFrame, time_frame: int) -> pd.DataFrame:
+    """Key the sums of the custom time frame by date like time_intervals does"""
+    if time_frame == 5:
+        sums.index = [datetime.strptime(day, "%Y-%m-%d").date() for day in sums.index]
+    return sums
+
+
+class TradeStore:
+    """
+    A SQLite database of the rows of any number of account history exports
+
+    The database file is only created when create is True, opening a missing one raises a
+    FileNotFoundError instead of analyzing an empty store.
+
+    Attributes:
+        path (str): The path to the database file
+        connection (sqlite3.Connection): The connection to the database
+
+    Methods:
+        ingest(account_history_path: str, progress) -> int: Insert the new rows of an export, return the number inserted
+        row_count() -> int: Return the number of stored rows
+        ingests() -> list: Return the path, size, rows and inserted rows of every ingest, newest first
+        analyze(time_frame: int, custom_range: tuple, details: bool, symbols: list, progress) -> dict: Analyze the stored rows
+        close() -> None: Close the database
+    """
+    def __init__(self, path: str, create: bool = False):
+        if not create and not os.path.isfile(path):
+            raise FileNotFoundError(f"No trade store at {path}, create it with 'ingest' first")
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> 'TradeStore':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the database"""
+        self.connection.close()
+
+    def ingest(self, account_history_path: str, progress=None) -> int:
+        """Insert the rows of an account history export that aren't stored yet and return the number inserted
+
+        progress is called as progress("rows", count) with the rows read so far.
+        """
+        stat = os.stat(account_history_path)
+        path = os.path.abspath(account_history_path)
+        unchanged = self.connection.execute(
+            "SELECT 1 FROM ingests WHERE path = ? AND size = ? AND mtime = ?", (path, stat.st_size, stat.st_mtime)
+        ).fetchone()
+        if unchanged:
+            return 0
+
+        open_account_history(account_history_path, use_cache=False)  # Validate the file before inserting anything
+        rows = 0
+        inserted = 0
+        placeholders = ', '.join('?' * (len(STORE_COLUMNS) + 1))
+        with self.connection:
+            for account_df in read_chunks(account_history_path, CHUNK_SIZE):
+                cursor = self.connection.executemany(
+                    f"INSERT OR IGNORE INTO history (row_key, {', '.join(STORE_COLUMNS)}) VALUES ({placeholders})",
+                    store_rows(account_df)
+                )
+                inserted += cursor.rowcount
+                rows += len(account_df)
+                if progress:
+                    progress("rows", rows)
+            self.connection.execute(
+                "INSERT INTO ingests VALUES (?, ?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime, rows, inserted, time.time())
+            )
+        return inserted
+
+    def row_count(self) -> int:
+        """Return the number of stored rows"""
+        return self.connection.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def ingests(self) -> list:
+        """Return the path, size, rows and inserted rows of every ingest, newest first"""
+        cursor = self.connection.execute(
+            "SELECT path, size, rows, inserted, ingested FROM ingests ORDER BY ingested DESC"
+        )
+        return [dict(zip(['path', 'size', 'rows', 'inserted', 'ingested'], row)) for row in cursor]
+
+    def analyze(
+            self, time_frame: int, custom_range=(None, None), details: bool = True, symbols: list = None, progress=None
+        ) -> dict:
+        """Analyze the stored rows like AccountHistory.analyze, optionally only the rows of some symbols
+
+        A custom range is used as a date range of any time frame, the sums are aggregated in SQL and
+        only the trades of the report are read. The sums are exact, where pandas sums floats, so a
+        total on a rounding boundary can be a cent or a hundredth of a percent off the csv report.
+        """
+        if time_frame not in INTERVAL_SQL:
+            raise ValueError("Invalid time frame")
+        conditions = []
+        parameters = []
+        if time_frame == 5 or custom_range != (None, None):
+            start, end = parse_custom_range(custom_range)
+            conditions.append("time >= ? AND time < date(?, '+1 day')")
+            parameters += [start.isoformat(), end.isoformat()]
+        if symbols:
+            conditions.append(f"symbol IN ({', '.join('?' * len(symbols))})")
+            parameters += list(symbols)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        interval = INTERVAL_SQL[time_frame]
+
+        sums = pd.read_sql_query(SUMS_SQL.format(interval=interval, where=where), self.connection, params=parameters)
+        sums = sums.set_index('interval')
+        if sums.empty:
+            return {}
+        if progress:
+            progress("rows", int(sums['Number of Trades'].sum()))
+        if not details:
+            return build_dataframes(date_keyed(sums, time_frame), progress=progress)
+
+        trades = pd.read_sql_query(
+            TRADES_SQL.format(interval=interval, where=where, conjunction="AND" if where else "WHERE"),
+            self.connection, params=parameters
+        )
+        trade_codes = sums.index.get_indexer(trades.pop('interval'))
+        trades.columns = DETAIL_COLUMNS
+        trades['Time'] = pd.to_datetime(trades['Time'], format='%Y-%m-%d %H:%M:%S')
+        trades['Position'] = trades['Position'].astype(POSITIONS)
+        trades['Symbol'] = trades['Symbol'].astype('category')
+        return build_dataframes(date_keyed(sums, time_frame), trades, trade_codes, progress)
+
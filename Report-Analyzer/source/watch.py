@@ -0,0 +1,265 @@
+"""
+Watch a directory of account history exports and keep a report of them up to date
+
+Every export in the directory is checked by its size and modification time only, an export is read
+once it was changed and its size and time stayed the same for a poll, so half written files are left
+alone. An export that only grew is read from where the last read ended, any other changed export is
+read again in full. Only the rows that aren't known yet, by the same row key the trade store uses,
+are parsed and aggregated: their sums are added to the sums of their intervals and only the
+intervals they fall in are rendered again. The html of every other interval is kept from the
+previous update and the report is put together from the kept html. An update that fails is undone
+and reported, the watcher keeps the report it had.
+"""
+
+import fnmatch
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from source.csv_functions import (
+    TIME_FRAME_NAMES, ThousandsStrippedFile, add_sums, aggregate_history, build_dataframes, concat_histories,
+    open_account_history, open_report, parse_account_history, read_account_csv, write_html_head,
+    write_report_intervals
+)
+from source.store import row_keys
+
+# Bytes before the end of the last read an export must still have to be read from there
+FINGERPRINT_BYTES = 256
+
+
+class FragmentWriter:
+    """Collects written html as a list of strings, tell returns the number of strings written so far"""
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text: str) -> None:
+        self.parts.append(text)
+
+    def tell(self) -> int:
+        return len(self.parts)
+
+
+def render_intervals(report: dict) -> dict:
+    """Return the html of every interval of a report, keyed by interval"""
+    writer = FragmentWriter()
+    ends = []
+    write_report_intervals(writer, report, lambda stage, count: ends.append(count))
+    starts = [0] + ends[:-1]
+    return {interval: ''.join(writer.parts[start:end]) for interval, start, end in zip(report, starts, ends)}
+
+
+class ReportWatcher:
+    """
+    Keeps the html report of the account history exports in a directory up to date as new exports land
+
+    Attributes:
+        directory (str): The directory that is watched
+        output (str): The html report to write, gzip compressed if it ends in .gz
+        time_frames (tuple): The time frames of the report, a section each if there are several
+        details (bool): Include the trade details in the report
+        pattern (str): The file name pattern of the exports
+        row_count (int): The number of different rows read so far
+
+    Methods:
+        poll() -> list: Return the exports that changed since they were last read and are done being written
+        read_offset(path: str) -> int: Return where the last read of an export ended if it only grew since
+        end_offset(path: str) -> tuple: Return where a read of an export ends and the bytes before it
+        new_rows(path: str) -> pd.DataFrame: Return the parsed rows of an export that weren't read before
+        update(paths: list) -> dict: Add the new rows of exports and render the intervals they changed
+        write_report() -> None: Write the report from the html of every interval
+        check() -> dict: Poll the directory, update and write the report if an export changed, undo a failed update
+        save_state() -> tuple: Return the state to undo an update with
+        restore_state(state: tuple) -> None: Undo the updates made since a state was saved
+        run(poll_interval: float, callback) -> None: Check the directory every poll_interval seconds until interrupted
+    """
+    def __init__(
+            self, directory: str, output: str, time_frames=(4,), details: bool = True, pattern: str = "*.csv"
+        ):
+        if any(time_frame not in (1, 2, 3, 4) for time_frame in time_frames):
+            raise ValueError("Only the daily, monthly, quarterly and yearly time frames can be watched")
+        if not os.path.isdir(directory):
+            raise ValueError(f"Not a directory: {directory}")
+        self.directory = directory
+        self.output = output
+        self.time_frames = tuple(time_frames)
+        self.details = details
+        self.pattern = pattern
+        self.row_count = 0
+        self._read = {}  # The size and mtime every export had when it was read
+        self._polled = None  # The size and mtime every export had at the last poll
+        self._offsets = {}  # Where the last read of every export ended and the bytes just before it
+        self._keys = np.empty(0, dtype=np.int64)
+        self._trades = None
+        self._trade_intervals = {time_frame: np.empty(0, dtype=object) for time_frame in self.time_frames}
+        self._sums = dict.fromkeys(self.time_frames)
+        self._html = {time_frame: {} for time_frame in self.time_frames}
+
+    def poll(self) -> list:
+        """Return the exports that changed since they were last read and are done being written, oldest first
+
+        Only the size and modification time of the files are checked. On the first poll every export
+        is returned, after that a changed export is returned once it stayed the same for a poll.
+        """
+        first_poll = self._polled is None
+        polled = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and fnmatch.fnmatch(entry.name, self.pattern):
+                    stat = entry.stat()
+                    polled[entry.path] = (stat.st_size, stat.st_mtime)
+
+        changed = [
+            path for path, signature in polled.items()
+            if self._read.get(path) != signature and (first_poll or self._polled.get(path) == signature)
+        ]
+        self._polled = polled
+        return sorted(changed, key=lambda path: polled[path][1])
+
+    def read_offset(self, path: str) -> int:
+        """Return where the last read of an export ended if the export only grew since, otherwise 0"""
+        if path not in self._offsets:
+            return 0
+        offset, fingerprint = self._offsets[path]
+        with open(path, 'rb') as f:
+            f.seek(offset - len(fingerprint))
+            unchanged = f.read(len(fingerprint)) == fingerprint and f.read(1) != b''
+        return offset if unchanged else 0
+
+    def end_offset(self, path: str) -> tuple:
+        """Return where a read of an export ends, at its end if its last line is complete, and the bytes before it
+
+        Taken before the export is read, rows written while it is read are read again with the next
+        change and dropped as known rows.
+        """
+        with open(path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(size - FINGERPRINT_BYTES, 0))
+            fingerprint = f.read(size - f.tell())
+        # The last row may still be written to, the export is read in full with the next change
+        return (size, fingerprint) if fingerprint.endswith(b'\n') else None
+
+    def new_rows(self, path: str) -> pd.DataFrame:
+        """Return the parsed rows of an export that weren't read before"""
+        open_account_history(path, use_cache=False)  # Validate the header before reading the file
+        offset = self.read_offset(path)
+        end = self.end_offset(path)
+        with ThousandsStrippedFile(path, offset) as source:
+            account_df = read_account_csv(source)
+        self._offsets.pop(path, None)
+        if end:
+            self._offsets[path] = end
+        keys = row_keys(account_df, pd.DataFrame({'Time': pd.to_datetime(account_df['Time'], format='ISO8601')}))
+        is_new = ~np.isin(keys, self._keys) & ~pd.Series(keys).duplicated().to_numpy()
+        self._keys = np.concatenate([self._keys, keys[is_new]])
+        # Only the new rows are parsed
+        return parse_account_history(account_df[is_new].reset_index(drop=True))
+
+    def update(self, paths: list) -> dict:
+        """Add the new rows of exports, render the intervals they changed and return what changed
+
+        Returns the number of new rows, the changed intervals of every time frame and the error of
+        every export that couldn't be read. An export that failed is read again once it changes.
+        """
+        histories = []
+        errors = {}
+        for path in paths:
+            try:
+                history = self.new_rows(path)
+            except (OSError, ValueError) as e:
+                errors[path] = str(e)
+                continue
+            finally:
+                if self._polled and path in self._polled:
+                    self._read[path] = self._polled[path]
+            if len(history):
+                histories.append(history)
+        history = concat_histories(histories) if histories else None
+
+        changed = {time_frame: [] for time_frame in self.time_frames}
+        if history is not None:
+            self.row_count += len(history)
+            for time_frame in self.time_frames:
+                changed[time_frame] = self.add_rows(time_frame, history)
+        return {'rows': 0 if history is None else len(history), 'intervals': changed, 'errors': errors}
+
+    def add_rows(self, time_frame: int, history: pd.DataFrame) -> list:
+        """Add new parsed rows to the sums of their intervals, render those intervals again and return them"""
+        sums, trades, trade_intervals = aggregate_history([history], time_frame, details=self.details)
+        # Newest interval first, like the intervals of an export
+        self._sums[time_frame] = add_sums(self._sums[time_frame], sums).sort_index(ascending=False)
+        changed = list(sums.index)
+
+        if self.details:
+            if time_frame == self.time_frames[0]:
+                self._trades = trades if self._trades is None else concat_histories([self._trades, trades])
+            self._trade_intervals[time_frame] = np.concatenate([self._trade_intervals[time_frame], trade_intervals])
+
+        changed_sums = self._sums[time_frame].loc[self._sums[time_frame].index.isin(changed)]
+        if self.details:
+            in_changed = pd.Index(self._trade_intervals[time_frame]).isin(changed_sums.index)
+            changed_trades = self._trades[in_changed]
+            # Newest trade first within every interval, like the rows of an export
+            order = np.argsort(-changed_trades['Time'].to_numpy().view(np.int64), kind='stable')
+            changed_trades = changed_trades.iloc[order]
+            codes = changed_sums.index.get_indexer(self._trade_intervals[time_frame][in_changed][order])
+            report = build_dataframes(changed_sums, changed_trades, codes)
+        else:
+            report = build_dataframes(changed_sums)
+        self._html[time_frame].update(render_intervals(report))
+        return list(changed_sums.index)
+
+    def write_report(self) -> None:
+        """Write the report from the html of every interval, replacing the previous report at once"""
+        temporary_path = f"{self.output}.{os.getpid()}.tmp"
+        with open_report(temporary_path, self.output.endswith('.gz')) as f:
+            write_html_head(f)
+            for time_frame in self.time_frames:
+                if len(self.time_frames) > 1:
+                    f.write(f'<h1>{TIME_FRAME_NAMES[time_frame]} Report</h1>\n')
+                if self._sums[time_frame] is not None:
+                    for interval in self._sums[time_frame].index:
+                        f.write(self._html[time_frame][interval])
+            f.write('</body>\n')
+            f.write('</html>\n')
+        os.replace(temporary_path, self.output)
+
+    def check(self) -> dict:
+        """Poll the directory, add the new rows of the changed exports and write the report if anything changed"""
+        paths = self.poll()
+        if not paths:
+            return {'rows': 0, 'intervals': {}, 'errors': {}, 'paths': []}
+        state = self.save_state()
+        try:
+            changes = self.update(paths)
+            if changes['rows'] or not os.path.exists(self.output):
+                self.write_report()
+        except Exception as e:  # Any failure of one update, so it doesn't end the watcher
+            self.restore_state(state)
+            changes = {
+                'rows': 0, 'intervals': {}, 'errors': dict.fromkeys(paths, f"Update failed, undone: {e}"),
+            }
+        changes['paths'] = paths
+        return changes
+
+    def save_state(self) -> tuple:
+        """Return the rows, sums and html read so far, to undo an update with"""
+        return (
+            self.row_count, dict(self._offsets), self._keys, self._trades, dict(self._trade_intervals),
+            dict(self._sums), {time_frame: dict(html) for time_frame, html in self._html.items()}
+        )
+
+    def restore_state(self, state: tuple) -> None:
+        """Undo the updates made since a state was saved, the rows they read are read again with the next change"""
+        (
+            self.row_count, self._offsets, self._keys, self._trades, self._trade_intervals, self._sums, self._html
+        ) = state
+
+    def run(self, poll_interval: float = 5.0, callback=None) -> None:
+        """Check the directory every poll_interval seconds until interrupted, callback is called with every change"""
+        while True:
+            changes = self.check()
+            if callback and changes['paths']:
+                callback(changes)
+            time.sleep(poll_interval)